@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import asyncio
+import logging
+import platform
+import resource
+import tempfile
+import threading
+from collections import Counter, defaultdict
+
+import paramiko
+from aiohttp import web
+
+BENCH_TOKEN = '123456:' + 'A' * 35
+
+DEFAULT_MIX = {
+    'main_menu': 10,
+    'status': 10,
+    'services': 5,
+    'check_disk': 15,
+    'check_load': 10,
+    'check_memory': 5,
+    'status_nginx': 15,
+    'service_docker': 10,
+    'docker_info_web-1': 10,
+    'history_disk_hour': 5,
+    'logs_system': 3,
+    'restart_nginx': 2,
+}
+
+def build_containers(count: int) -> list:
+    containers = []
+    for i in range(count):
+        running = i % 7 != 6
+        containers.append({
+            'Id': f'{i:012x}' * 5 + f'{i:04x}',
+            'Name': f'/web-{i}',
+            'Image': f'registry.local/app-{i % 5}:latest',
+            'Status': 'running' if running else 'exited',
+            'ExitCode': 0 if running else 137,
+            'StartedAt': '2026-01-01T00:00:00.000000000Z',
+            'Health': None,
+            'RestartCount': i % 3,
+        })
+    return containers
+
+class CannedOutputs:
+    def __init__(self, lines: int, containers: int):
+        self.lines = lines
+        self.inspect = ''.join(json.dumps(container) + '\n' for container in build_containers(containers))
+        self.journal = ''.join(f"Jan 01 00:00:{i % 60:02d} host app[{1000 + i}]: request {i} handled in {i % 97} ms\n"
+                               for i in range(lines))
+        self.probe = (
+            "@loadavg\n0.52 0.61 0.58 2/345 12345\n"
+            "@cpu\ncpu  4705 150 1120 1644300 520 0 23 0 0 0\n8\n"
+            "@meminfo\nMemTotal:       16318484 kB\nMemAvailable:   10110832 kB\n"
+            "SwapTotal:       2097148 kB\nSwapFree:        2097148 kB\n"
+            "@mounts\n25671918 12030491 13292157 4096 /\n1214463 1014463 1040463 4096 /boot\n"
+            "@units\n"
+            + ''.join(f"Id={unit}.service\nLoadState=loaded\nActiveState=active\nSubState=running\n\n"
+                      for unit in ('nginx', 'postgresql', 'docker'))
+        )
+
+    def respond(self, command: str) -> str:
+        if command.startswith("echo '@loadavg'"):
+            return self.probe
+        if 'docker inspect' in command:
+            return f"{int(time.time())}\n{self.inspect}"
+        if 'systemctl is-active' in command:
+            return 'active\n'
+        if 'systemctl status' in command:
+            return ("● nginx.service - A high performance web server\n"
+                    "     Loaded: loaded (/lib/systemd/system/nginx.service; enabled)\n"
+                    "     Active: active (running) since Thu 2026-01-01 00:00:00 UTC; 1 day ago\n"
+                    + self.journal[:2000])
+        if 'journalctl' in command or command.startswith('tail'):
+            return self.journal
+        if 'docker ps' in command:
+            return 'CONTAINER ID   IMAGE   STATUS\n' + self.journal[:1000]
+        if command.startswith('df'):
+            return "Filesystem Size Used Avail Use% Mounted on\n/dev/sda1 98G 46G 52G 47% /\n"
+        return ''
+
+class BenchSSHServer(paramiko.ServerInterface):
+    def __init__(self, owner):
+        self.owner = owner
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.owner.execute, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+class FakeSSH:
+    def __init__(self, outputs: CannedOutputs, latency: float):
+        self.outputs = outputs
+        self.latency = latency
+        self.key = paramiko.RSAKey.generate(2048)
+        self.sessions = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.socket = socket.socket()
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(100)
+        self.port = self.socket.getsockname()[1]
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self) -> None:
+        while True:
+            client, _ = self.socket.accept()
+            with self.lock:
+                self.connections += 1
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.key)
+            transport.start_server(server=BenchSSHServer(self))
+
+    def execute(self, channel: paramiko.Channel, command: str) -> None:
+        with self.lock:
+            self.sessions += 1
+        try:
+            if 'docker events' in command:
+                # Подписка инвентаря на события: держим канал открытым, пока клиент его не закроет
+                while not channel.closed:
+                    time.sleep(0.5)
+                return
+            time.sleep(self.latency)
+            output = self.outputs.respond(command).encode()
+            for offset in range(0, len(output), 32768):
+                channel.sendall(output[offset:offset + 32768])
+            channel.send_exit_status(0)
+        except Exception:
+            pass
+        finally:
+            channel.close()
+
+class FakeTelegram:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = Counter()
+        self.message_id = 1000
+        self.runner = None
+        self.port = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            data = await request.json()
+        else:
+            data = await request.post()
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'bench',
+                                                             'username': 'bench_bot'}})
+        if method.startswith(('send', 'edit')):
+            self.message_id += 1
+            chat_id = int(data.get('chat_id', 0) or 0)
+            return web.json_response({'ok': True, 'result': {
+                'message_id': int(data.get('message_id', 0) or self.message_id),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': str(data.get('text', '')),
+            }})
+        return web.json_response({'ok': True, 'result': True})
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        await web.SockSite(self.runner, sock).start()
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+def write_config(args, ssh_port: int, api_url: str) -> str:
+    servers = {f'server{i + 1}': {'hostname': '127.0.0.1', 'port': ssh_port, 'username': 'bench',
+                                  'password': 'bench', 'look_for_keys': False, 'allow_agent': False}
+               for i in range(args.servers)}
+    config = {
+        'TOKEN': BENCH_TOKEN,
+        'ADMIN_IDS': [1000 + i for i in range(args.users)],
+        'SSH_CONFIG': servers,
+        'TELEGRAM_API_URL': api_url,
+        'METRICS': {'enabled': False},
+        'ALERTS': {'enabled': False},
+    }
+    if not args.real_limits:
+        config['OUTBOX'] = {'rate': 100000, 'chat_rate': 100000, 'chat_burst': 100000, 'concurrency': 64}
+    handle, path = tempfile.mkstemp(prefix='bench-config-', suffix='.json')
+    with os.fdopen(handle, 'w') as f:
+        json.dump(config, f)
+    return path
+
+def callback_update(tb, update_id: int, user_id: int, data: str):
+    return tb.types.Update.model_validate({
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {'message_id': update_id, 'date': int(time.time()),
+                        'chat': {'id': user_id, 'type': 'private'}, 'text': 'menu'},
+        },
+    }, context={'bot': tb.bot})
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+def summarize(latencies: list) -> dict:
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+async def profile_sessions(tb, ssh: FakeSSH, actions, user_id: int) -> dict:
+    # Каждое действие отдельно и с пустым кэшем: сколько SSH сессий оно открывает само по себе
+    sessions = {}
+    for i, action in enumerate(actions):
+        tb.command_cache.results.clear()
+        before = ssh.sessions
+        await tb.dp.feed_update(tb.bot, callback_update(tb, 10 ** 6 + i, user_id, action))
+        sessions[action] = ssh.sessions - before
+    return sessions
+
+async def replay(tb, mix: dict, total: int, concurrency: int, users: list, seed: int) -> tuple:
+    rng = random.Random(seed)
+    actions = rng.choices(list(mix), weights=list(mix.values()), k=total)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = defaultdict(list)
+    errors = Counter()
+
+    async def run_one(update_id: int, action: str):
+        async with semaphore:
+            update = callback_update(tb, update_id, rng.choice(users), action)
+            started = time.perf_counter()
+            try:
+                await tb.dp.feed_update(tb.bot, update)
+            except Exception:
+                errors[action] += 1
+            latencies[action].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one(i + 1, action) for i, action in enumerate(actions)))
+    return latencies, errors, time.perf_counter() - started
+
+async def run_benchmark(args) -> dict:
+    outputs = CannedOutputs(args.output_lines, args.containers)
+    ssh = FakeSSH(outputs, args.ssh_latency / 1000)
+    ssh.start()
+    telegram = FakeTelegram(args.telegram_latency / 1000)
+    await telegram.start()
+
+    os.environ['BOT_CONFIG'] = write_config(args, ssh.port, f'http://127.0.0.1:{telegram.port}')
+    import telegram_bot as tb
+    tb.setup_dispatcher()
+    for inventory in tb.container_inventories.values():
+        inventory.start()
+
+    users = list(tb.ADMIN_IDS)
+    mix = json.loads(args.mix) if args.mix else DEFAULT_MIX
+    try:
+        # Прогрев: соединения в пуле, инвентарь контейнеров
+        await replay(tb, mix, min(len(mix) * 2, args.updates), args.concurrency, users, args.seed + 1)
+        sessions_per_action = await profile_sessions(tb, ssh, list(mix), users[0])
+
+        ssh_before, connections_before = ssh.sessions, ssh.connections
+        api_before = Counter(telegram.calls)
+        latencies, errors, elapsed = await replay(tb, mix, args.updates, args.concurrency, users, args.seed)
+    finally:
+        for inventory in tb.container_inventories.values():
+            inventory.stop()
+        tb.outbox.close()
+        tb.ssh_executor.shutdown()
+        tb.ssh_pool.close_all()
+        await tb.bot.session.close()
+        await telegram.stop()
+        os.unlink(os.environ['BOT_CONFIG'])
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'paramiko': paramiko.__version__,
+        },
+        'parameters': vars(args),
+        'mix': mix,
+        'overall': {
+            **summarize(all_latencies),
+            'errors': sum(errors.values()),
+            'elapsed_s': round(elapsed, 3),
+            'throughput_per_s': round(len(all_latencies) / elapsed, 2) if elapsed else 0.0,
+            'ssh_sessions': ssh.sessions - ssh_before,
+            'ssh_connections': ssh.connections - connections_before,
+            'ssh_sessions_per_update': round((ssh.sessions - ssh_before) / max(len(all_latencies), 1), 3),
+            'telegram_calls': dict(telegram.calls - api_before),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        'actions': {
+            action: {**summarize(latencies[action]), 'errors': errors[action],
+                     'ssh_sessions': sessions_per_action.get(action, 0)}
+            for action in sorted(latencies)
+        },
+    }
+
+def print_report(result: dict, baseline: dict = None) -> None:
+    overall = result['overall']
+    print(f"Обновлений: {overall['count']} за {overall['elapsed_s']} с, "
+          f"{overall['throughput_per_s']} в секунду, ошибок: {overall['errors']}")
+    print(f"Задержка: p50 {overall['p50_ms']} мс, p95 {overall['p95_ms']} мс, p99 {overall['p99_ms']} мс")
+    print(f"SSH сессий: {overall['ssh_sessions']} ({overall['ssh_sessions_per_update']} на обновление), "
+          f"новых соединений: {overall['ssh_connections']}")
+    print(f"Пиковый RSS: {overall['peak_rss_mb']} МБ")
+    print()
+    header = f"{'действие':<22}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'ssh':>6}"
+    if baseline:
+        header += f"{'Δp95':>10}"
+    print(header)
+    for action, stats in result['actions'].items():
+        line = (f"{action:<22}{stats['count']:>6}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+                f"{stats['p99_ms']:>10}{stats['ssh_sessions']:>6}")
+        previous = (baseline or {}).get('actions', {}).get(action)
+        if previous and previous['p95_ms']:
+            line += f"{(stats['p95_ms'] / previous['p95_ms'] - 1) * 100:>+9.1f}%"
+        print(line)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота без сети: локальный SSH сервер и заглушка Bot API')
+    parser.add_argument('--updates', type=int, default=500, help='сколько обновлений отправить')
+    parser.add_argument('--concurrency', type=int, default=20, help='сколько обновлений обрабатывается одновременно')
+    parser.add_argument('--users', type=int, default=10, help='сколько администраторов нажимают кнопки')
+    parser.add_argument('--servers', type=int, default=3, help='сколько серверов в SSH_CONFIG')
+    parser.add_argument('--ssh-latency', type=float, default=20, help='задержка выполнения команды на сервере, мс')
+    parser.add_argument('--telegram-latency', type=float, default=30, help='задержка ответа Bot API, мс')
+    parser.add_argument('--output-lines', type=int, default=200, help='строк в выводе журналов')
+    parser.add_argument('--containers', type=int, default=30, help='контейнеров на каждом сервере')
+    parser.add_argument('--mix', help='смесь действий в JSON: {"callback_data": вес, ...}')
+    parser.add_argument('--real-limits', action='store_true', help='не отключать ограничения скорости отправки')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='сохранить результат в JSON')
+    parser.add_argument('--compare', help='сравнить с сохраненным результатом')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    result = asyncio.run(run_benchmark(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+if __name__ == '__main__':
+    main()
@@ -7,22 +7,50 @@ import paramiko
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command, StateFilter
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery, BufferedInputFile, InputFile
 from aiogram.fsm.storage.memory import MemoryStorage
-from datetime import datetime
+from datetime import datetime, timezone
+from dataclasses import dataclass, field
+from typing import Optional
 import tempfile
+import concurrent.futures
 import asyncio
 import json
+import threading
+import time
+import select
+import shlex
+import secrets
+import signal
+import zipfile
+import zlib
+import gzip
+import io
+import math
+import re
+import bisect
+from array import array
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import (SendMessage, SendPhoto, SendDocument, EditMessageText,
+                             EditMessageReplyMarkup, AnswerCallbackQuery, DeleteMessage)
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                    level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def load_config():
+    path = os.environ.get('BOT_CONFIG', 'config.json')
     try:
-        with open('config.json', 'r') as f:
+        with open(path, 'r') as f:
             return json.load(f)
     except FileNotFoundError:
         default_config = {
@@ -36,7 +64,7 @@ def load_config():
                 }
             }
         }
-        with open('config.json', 'w') as f:
+        with open(path, 'w') as f:
             json.dump(default_config, f, indent=4)
         return default_config
 
@@ -44,38 +72,412 @@ config = load_config()
 TOKEN = config['TOKEN']
 ADMIN_IDS = config['ADMIN_IDS']
 SSH_CONFIG = config['SSH_CONFIG']
+SSH_POOL_CONFIG = config.get('SSH_POOL', {})
+SSH_EXEC_CONFIG = config.get('SSH_EXEC', {})
+STREAM_EDIT_INTERVAL = config.get('STREAM_EDIT_INTERVAL', 2.0)
+FANOUT_CONFIG = config.get('FANOUT', {})
+DOCKER_LOGS_CONFIG = config.get('DOCKER_LOGS', {})
+DOCKER_INVENTORY_CONFIG = config.get('DOCKER_INVENTORY', {})
+METRICS_CONFIG = config.get('METRICS', {})
+LOG_EXPORT_CONFIG = config.get('LOG_EXPORT', {})
+ALERTS_CONFIG = config.get('ALERTS', {})
+COMMAND_CACHE_CONFIG = config.get('COMMAND_CACHE', {})
+OUTBOX_CONFIG = config.get('OUTBOX', {})
+WEBHOOK_CONFIG = config.get('WEBHOOK', {})
+STATS_CONFIG = config.get('STATS', {})
+ROLLING_CONFIG = config.get('ROLLING', {})
+REACHABILITY_CONFIG = config.get('REACHABILITY', {})
+PAGER_CONFIG = config.get('PAGER', {})
+TELEGRAM_API_URL = config.get('TELEGRAM_API_URL')
+MONITORED_UNITS = config.get('MONITORED_UNITS', ['nginx', 'postgresql', 'docker'])
+ALL_SERVERS = '*'
+MESSAGE_OUTPUT_LIMIT = 3500
 
-def get_container_status_emoji(status: str) -> str:
-    if 'Up' in status:
-        return '🟢'
-    elif 'Exited' in status:
+@dataclass
+class ContainerState:
+    id: str
+    name: str
+    image: str
+    status: str
+    exit_code: Optional[int] = None
+    started_at: Optional[datetime] = None
+    health: Optional[str] = None
+    restart_count: int = 0
+
+def parse_docker_time(value: str) -> Optional[datetime]:
+    if not value or value.startswith('0001-'):
+        return None
+    return datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return f"{days} д {hours} ч"
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    if minutes:
+        return f"{minutes} мин"
+    return f"{seconds} с"
+
+def get_container_status_emoji(container: ContainerState) -> str:
+    if container.status == 'running':
+        return '🟠' if container.health == 'unhealthy' else '🟢'
+    elif container.status in ('exited', 'dead'):
         return '🔴'
-    elif 'Created' in status:
+    elif container.status == 'created':
         return '⚪'
-    elif 'Restarting' in status:
+    elif container.status == 'restarting':
         return '🟡'
-    elif 'Paused' in status:
+    elif container.status == 'paused':
         return '⏸️'
     else:
         return '❓'
 
-def format_container_status(status: str) -> str:
-    if 'Up' in status:
-        uptime = status.split('Up ')[1].split(',')[0]
-        return f"Запущен (работает {uptime})"
-    elif 'Exited' in status:
-        exit_code = status.split('Exited (')[1].split(')')[0]
-        return f"Остановлен (код выхода: {exit_code})"
-    elif 'Created' in status:
+def format_container_status(container: ContainerState) -> str:
+    if container.status == 'running':
+        if container.started_at:
+            uptime = format_duration((datetime.now(timezone.utc) - container.started_at).total_seconds())
+            text = f"Запущен (работает {uptime})"
+        else:
+            text = "Запущен"
+        if container.health:
+            text += f", healthcheck: {container.health}"
+        return text
+    elif container.status in ('exited', 'dead'):
+        return f"Остановлен (код выхода: {container.exit_code})"
+    elif container.status == 'created':
         return "Создан"
-    elif 'Restarting' in status:
+    elif container.status == 'restarting':
         return "Перезапускается"
-    elif 'Paused' in status:
+    elif container.status == 'paused':
         return "Приостановлен"
     else:
-        return status
+        return container.status
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # Оценка по границам корзин, как histogram_quantile в Prometheus
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+class Telemetry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name: str, collect) -> None:
+        self.gauges[name] = collect
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def series(self, name: str):
+        with self.lock:
+            return [(dict(labels), histogram) for (metric, labels), histogram in self.histograms.items()
+                    if metric == name]
+
+    def counter(self, name: str, **match) -> float:
+        with self.lock:
+            return sum(value for (metric, labels), value in self.counters.items()
+                       if metric == name and match.items() <= dict(labels).items())
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        current = None
+        for (name, labels), histogram in histograms:
+            if name != current:
+                lines.append(f"# TYPE {name} histogram")
+                current = name
+            cumulative = 0
+            for bound, count in zip([*histogram.buckets, '+Inf'], histogram.counts):
+                cumulative += count
+                le = bound if isinstance(bound, str) else f"{bound:g}"
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            if name != current:
+                lines.append(f"# TYPE {name} counter")
+                current = name
+            lines.append(f"{name}{format_labels(labels)} {value:g}")
+        for name, collect in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in collect():
+                lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+telemetry = Telemetry()
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_EDIT = 1
+PRIORITY_BULK = 2
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self, now: float) -> float:
+        return min(self.burst, self.tokens + (now - self.updated) * self.rate)
+
+    def delay(self, now: float) -> float:
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        tokens = self.refill(now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self.tokens = self.refill(now) - 1
+        self.updated = now
+
+@dataclass(eq=False)
+class OutboundRequest:
+    priority: int
+    seq: int
+    chat_id: object
+    bot: object
+    method: object
+    make_request: object
+    coalesce_key: Optional[tuple] = None
+    futures: list = field(default_factory=list)
+    attempts: int = 0
+
+class OutboundQueue(BaseRequestMiddleware):
+    def __init__(self, rate: float, chat_rate: float, chat_burst: float, concurrency: int, max_retries: int):
+        self.global_bucket = TokenBucket(rate, rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.chats = {}
+        self.pending = []
+        self.edits = {}
+        self.seq = 0
+        self.tasks = set()
+        self.worker = None
+        self.wakeup = None
+        self.slots = None
+        self.stats = {'sent': 0, 'coalesced': 0, 'retried': 0, 'failed': 0}
+
+    def classify(self, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if isinstance(method, (EditMessageText, EditMessageReplyMarkup)):
+            key = (type(method).__name__, chat_id, method.message_id, method.inline_message_id)
+            return PRIORITY_EDIT, chat_id, key
+        if isinstance(method, SendDocument):
+            return PRIORITY_BULK, chat_id, None
+        if isinstance(method, (SendMessage, SendPhoto, AnswerCallbackQuery, DeleteMessage)):
+            return PRIORITY_INTERACTIVE, chat_id, None
+        return None
+
+    def ensure_started(self) -> None:
+        if self.worker is None or self.worker.done():
+            self.wakeup = asyncio.Event()
+            self.slots = asyncio.Semaphore(self.concurrency)
+            self.worker = asyncio.create_task(self.run())
+
+    async def __call__(self, make_request, bot, method):
+        kind = self.classify(method)
+        if kind is None:
+            return await make_request(bot, method)
+        priority, chat_id, key = kind
+        self.ensure_started()
 
-bot = Bot(token=TOKEN)
+        future = asyncio.get_running_loop().create_future()
+        request = self.edits.get(key) if key else None
+        if request is not None:
+            # Еще не отправленная правка того же сообщения: отправим только последнюю версию текста
+            request.method = method
+            request.make_request = make_request
+            request.futures.append(future)
+            self.stats['coalesced'] += 1
+        else:
+            self.seq += 1
+            request = OutboundRequest(priority, self.seq, chat_id, bot, method, make_request, key, [future])
+            self.enqueue(request)
+        return await future
+
+    def enqueue(self, request: OutboundRequest) -> None:
+        self.pending.append(request)
+        if request.coalesce_key:
+            self.edits[request.coalesce_key] = request
+        self.wakeup.set()
+
+    def chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) > 1024:
+                now = time.monotonic()
+                self.chats = {chat: b for chat, b in self.chats.items() if b.refill(now) < b.burst}
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def next_ready(self, now: float):
+        wait = self.global_bucket.delay(now)
+        if wait > 0:
+            return None, wait
+        best = None
+        wait = None
+        for request in self.pending:
+            delay = self.chat_bucket(request.chat_id).delay(now) if request.chat_id is not None else 0.0
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+            elif best is None or (request.priority, request.seq) < (best.priority, best.seq):
+                best = request
+        return best, wait
+
+    async def take(self) -> OutboundRequest:
+        while True:
+            now = time.monotonic()
+            request, wait = self.next_ready(now)
+            if request is not None:
+                self.pending.remove(request)
+                if request.coalesce_key and self.edits.get(request.coalesce_key) is request:
+                    del self.edits[request.coalesce_key]
+                self.global_bucket.take(now)
+                if request.chat_id is not None:
+                    self.chat_bucket(request.chat_id).take(now)
+                return request
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self) -> None:
+        while True:
+            await self.slots.acquire()
+            request = await self.take()
+            if all(future.done() for future in request.futures):
+                self.slots.release()
+                continue
+            task = asyncio.create_task(self.dispatch(request))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def dispatch(self, request: OutboundRequest) -> None:
+        method = type(request.method).__name__
+        started = time.perf_counter()
+        try:
+            result = await request.make_request(request.bot, request.method)
+        except TelegramRetryAfter as e:
+            telemetry.inc('telegram_retry_after_total', method=method)
+            self.retry(request, e)
+        except Exception as e:
+            telemetry.inc('telegram_errors_total', method=method)
+            self.stats['failed'] += 1
+            for future in request.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            self.stats['sent'] += 1
+            for future in request.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            telemetry.observe('telegram_request_seconds', time.perf_counter() - started, method=method)
+            self.slots.release()
+            self.wakeup.set()
+
+    def retry(self, request: OutboundRequest, error: TelegramRetryAfter) -> None:
+        request.attempts += 1
+        if request.attempts > self.max_retries:
+            self.stats['failed'] += 1
+            for future in request.futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        self.stats['retried'] += 1
+        logger.warning(f"Telegram просит подождать {error.retry_after} с перед {type(request.method).__name__}")
+        # Ждет либо конкретный чат, либо (если чата нет) все отправки
+        bucket = self.chat_bucket(request.chat_id) if request.chat_id is not None else self.global_bucket
+        bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + error.retry_after)
+
+        newer = self.edits.get(request.coalesce_key) if request.coalesce_key else None
+        if newer is not None:
+            newer.futures.extend(request.futures)
+            return
+        self.enqueue(request)
+
+    def close(self) -> None:
+        if self.worker is not None:
+            self.worker.cancel()
+        for task in list(self.tasks):
+            task.cancel()
+
+outbox = OutboundQueue(
+    OUTBOX_CONFIG.get('rate', 25),
+    OUTBOX_CONFIG.get('chat_rate', 1),
+    OUTBOX_CONFIG.get('chat_burst', 3),
+    OUTBOX_CONFIG.get('concurrency', 4),
+    OUTBOX_CONFIG.get('max_retries', 5),
+)
+
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else AiohttpSession()
+bot = Bot(token=TOKEN, session=session)
+bot.session.middleware(outbox)
+telemetry.gauge('telegram_outbox_pending', lambda: [({}, len(outbox.pending))])
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
@@ -128,50 +530,2049 @@ async def start(message: Message) -> None:
         reply_markup=keyboard
     )
 
-def execute_ssh_command(server: str, command: str) -> str:
-    try:
+class SSHConnectionPool:
+    def __init__(self, ssh_config: dict, keepalive: int = 30, idle_timeout: int = 300,
+                 connect_timeout: int = 10):
+        self.ssh_config = ssh_config
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.clients = {}
+        self.active = {server: 0 for server in ssh_config}
+        self.last_used = {}
+        self.locks = {server: threading.Lock() for server in ssh_config}
+        self.connect_locks = {server: threading.Lock() for server in ssh_config}
+        self.failures = {}
+        self.stats = {'hits': 0, 'misses': 0, 'reconnects': 0, 'evictions': 0}
+
+    def _connect(self, server: str) -> paramiko.SSHClient:
         client = paramiko.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(**SSH_CONFIG[server])
-        
-        stdin, stdout, stderr = client.exec_command(command, timeout=300)
-        
-        result = []
-        while not stdout.channel.exit_status_ready():
-            line = stdout.readline()
-            if line:
-                result.append(line.strip())
-        
-        remaining = stdout.read().decode()
-        if remaining:
-            result.append(remaining.strip())
-        
-        error = stderr.read().decode()
+        try:
+            with telemetry.timer('ssh_connect_seconds', server=server):
+                client.connect(**{'timeout': self.connect_timeout, **self.ssh_config[server]})
+        except Exception:
+            telemetry.inc('ssh_connect_errors_total', server=server)
+            raise
+        client.get_transport().set_keepalive(self.keepalive)
+        logger.info(f"SSH: установлено соединение с {server}")
+        return client
+
+    def _cached_transport(self, server: str) -> Optional[paramiko.Transport]:
+        with self.locks[server]:
+            client = self.clients.get(server)
+            transport = client.get_transport() if client else None
+            if transport is None or not transport.is_active():
+                return None
+            self.stats['hits'] += 1
+            self.last_used[server] = time.monotonic()
+            return transport
+
+    def check_failure(self, server: str) -> None:
+        # Недавняя ошибка подключения возвращается сразу, чтобы ждущие команды не подключались по очереди
+        failure = self.failures.get(server)
+        if failure is not None and time.monotonic() - failure[0] < self.connect_timeout:
+            raise paramiko.SSHException(f"сервер недоступен: {failure[1]}")
+
+    def acquire_transport(self, server: str, cancelled=None):
+        transport = self._cached_transport(server)
+        if transport is not None:
+            return transport, True
+        self.check_failure(server)
+        # Подключение идет под отдельным замком: пока хост не отвечает, состояние пула остается доступным
+        with self.connect_locks[server]:
+            transport = self._cached_transport(server)
+            if transport is not None:
+                return transport, True
+            if cancelled is not None and cancelled():
+                raise RuntimeError("команда отменена")
+            self.check_failure(server)
+            with self.locks[server]:
+                self.stats['misses'] += 1
+                stale = self.clients.pop(server, None)
+                if stale is not None:
+                    self.stats['reconnects'] += 1
+            if stale is not None:
+                stale.close()
+            try:
+                client = self._connect(server)
+            except Exception as e:
+                self.failures[server] = (time.monotonic(), str(e) or type(e).__name__)
+                raise
+            self.failures.pop(server, None)
+            with self.locks[server]:
+                self.clients[server] = client
+                self.last_used[server] = time.monotonic()
+            return client.get_transport(), False
+
+    def get_transport(self, server: str) -> paramiko.Transport:
+        return self.acquire_transport(server)[0]
+
+    def discard(self, server: str) -> None:
+        with self.locks[server]:
+            client = self.clients.pop(server, None)
+        if client is not None:
+            client.close()
+
+    def open_channel(self, server: str, cancelled=None) -> paramiko.Channel:
+        transport, reused = self.acquire_transport(server, cancelled)
+        try:
+            return transport.open_session(timeout=self.connect_timeout)
+        except (paramiko.SSHException, EOFError, OSError):
+            if not reused:
+                raise
+            # Соединение из пула умерло между проверкой и открытием канала - переподключаемся
+            self.discard(server)
+            return self.acquire_transport(server, cancelled)[0].open_session(timeout=self.connect_timeout)
+
+    @contextmanager
+    def session(self, server: str, cancelled=None):
+        channel = self.open_channel(server, cancelled)
+        with self.locks[server]:
+            self.active[server] += 1
+        try:
+            yield channel
+        finally:
+            channel.close()
+            with self.locks[server]:
+                self.active[server] -= 1
+                self.last_used[server] = time.monotonic()
+
+    def evict_idle(self) -> None:
+        now = time.monotonic()
+        for server in self.ssh_config:
+            # Занятый сервер пропускаем до следующего прохода, а не ждем его
+            if not self.locks[server].acquire(blocking=False):
+                continue
+            try:
+                if server not in self.clients or self.active[server]:
+                    continue
+                if now - self.last_used.get(server, now) < self.idle_timeout:
+                    continue
+                client = self.clients.pop(server)
+                self.stats['evictions'] += 1
+            finally:
+                self.locks[server].release()
+            client.close()
+            logger.info(f"SSH: закрыто неактивное соединение с {server}")
+
+    def close_all(self) -> None:
+        for server in list(self.clients):
+            self.discard(server)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, 'open': len(self.clients), 'active': sum(self.active.values())}
+
+ssh_pool = SSHConnectionPool(
+    SSH_CONFIG,
+    keepalive=SSH_POOL_CONFIG.get('keepalive', 30),
+    idle_timeout=SSH_POOL_CONFIG.get('idle_timeout', 300),
+    connect_timeout=SSH_POOL_CONFIG.get('connect_timeout', 10)
+)
+telemetry.gauge('ssh_connections_open', lambda: [({}, len(ssh_pool.clients))])
+telemetry.gauge('ssh_channels_active', lambda: [({'server': server}, count) for server, count in ssh_pool.active.items()])
+
+class OutputTail:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.chunks = deque()
+        self.size = 0
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def write(self, data: bytes) -> None:
+        with self.lock:
+            self.chunks.append(data)
+            self.size += len(data)
+            self.total += len(data)
+            while self.chunks and self.size - len(self.chunks[0]) >= self.limit:
+                self.size -= len(self.chunks.popleft())
+
+    def getvalue(self) -> bytes:
+        with self.lock:
+            return b''.join(self.chunks)[-self.limit:]
+
+    def text(self) -> str:
+        return self.getvalue().decode('utf-8', errors='replace')
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > self.limit
+
+SHELL_KEYWORDS = {'for', 'while', 'if', 'echo', 'cd', 'set', 'export', 'test'}
+
+def command_kind(command: str) -> str:
+    if command == PROBE_COMMAND:
+        return 'probe'
+    words = command.split()
+    while words and (words[0] == 'sudo' or words[0].startswith('-') or '=' in words[0]):
+        words.pop(0)
+    name = os.path.basename(words[0]) if words else ''
+    if name in SHELL_KEYWORDS:
+        return 'shell'
+    return name if re.fullmatch(r'[a-z][a-z0-9_.-]{0,30}', name) else 'other'
+
+class RemoteCommand:
+    chunk_size = 32768
+
+    def __init__(self, server: str, command: str, timeout: float = 300, output_limit: int = 512 * 1024):
+        self.server = server
+        self.command = command
+        self.timeout = timeout
+        self.stdout = OutputTail(output_limit)
+        self.stderr = OutputTail(min(output_limit, 64 * 1024))
+        self.exit_status = None
+        self.channel = None
+        self.cancelled = False
+        self.kind = command_kind(command)
+        self.first_byte_at = None
+        self.received = 0
+
+    def run(self) -> str:
+        if self.cancelled:
+            return "❌ Ошибка: команда отменена"
+        try:
+            with ssh_pool.session(self.server, lambda: self.cancelled) as channel:
+                self.channel = channel
+                if self.cancelled:
+                    return "❌ Ошибка: команда отменена"
+                channel.settimeout(self.timeout)
+                started = time.perf_counter()
+                channel.exec_command(self.command)
+                self.read_output(channel)
+                self.exit_status = channel.recv_exit_status()
+                if not self.cancelled:
+                    self.record_timings(started)
+                return self.result()
+        except Exception as e:
+            telemetry.inc('ssh_errors_total', server=self.server, kind=self.kind)
+            if self.cancelled:
+                return "❌ Ошибка: команда отменена"
+            return f"❌ Ошибка: {str(e)}"
+
+    def record_timings(self, started: float) -> None:
+        # exec - до первого байта вывода, transfer - чтение вывода до завершения команды
+        finished = time.perf_counter()
+        first_byte = self.first_byte_at or finished
+        telemetry.observe('ssh_exec_seconds', first_byte - started, server=self.server, kind=self.kind)
+        telemetry.observe('ssh_transfer_seconds', finished - first_byte, server=self.server, kind=self.kind)
+        telemetry.inc('ssh_received_bytes_total', self.received, server=self.server, kind=self.kind)
+
+    def read_output(self, channel: paramiko.Channel) -> None:
+        # stdout и stderr читаются в одном цикле, чтобы ни один из потоков не заполнил окно канала
+        while True:
+            if channel.recv_ready():
+                data = channel.recv(self.chunk_size)
+                self.count_received(data)
+                self.handle_stdout(data)
+            elif channel.recv_stderr_ready():
+                data = channel.recv_stderr(self.chunk_size)
+                self.count_received(data)
+                self.stderr.write(data)
+            elif channel.eof_received or channel.closed:
+                break
+            else:
+                # select просыпается только на stdout, поэтому stderr проверяется по короткому таймауту
+                select.select([channel], [], [], 0.1)
+
+    def count_received(self, data: bytes) -> None:
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+        self.received += len(data)
+
+    def handle_stdout(self, data: bytes) -> None:
+        self.stdout.write(data)
+
+    def output_text(self) -> str:
+        text = self.stdout.text().strip()
+        if self.stdout.truncated:
+            text = f"... (показан конец вывода)\n{text}"
+        error = self.stderr.text().strip()
         if error:
-            result.append(f"Ошибка: {error}")
-        
-        client.close()
-        return '\n'.join(result)
-    except Exception as e:
-        return f"❌ Ошибка: {str(e)}"
+            text = f"{text}\nОшибка: {error}" if text else f"Ошибка: {error}"
+        return text
+
+    def result(self) -> str:
+        return self.output_text()
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        if self.channel is not None:
+            self.channel.close()
+
+def execute_ssh_command(server: str, command: str) -> str:
+    return RemoteCommand(server, command).run()
+
+class SSHExecutor:
+    def __init__(self, servers, concurrency: int = 4, max_queue: int = 20, timeout: float = 300,
+                 output_limit: int = 512 * 1024):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.output_limit = output_limit
+        # Семафоры создаются при первом использовании, уже внутри работающего цикла событий
+        self.semaphores = {}
+        self.pending = {server: 0 for server in servers}
+        self.threads = ThreadPoolExecutor(max_workers=max(1, len(self.pending) * concurrency),
+                                          thread_name_prefix='ssh')
+
+    async def run(self, server: str, command: str, timeout: float = None) -> str:
+        return await self.execute(RemoteCommand(server, command, timeout or self.timeout, self.output_limit))
+
+    async def execute(self, remote: RemoteCommand) -> str:
+        server = remote.server
+        if server not in self.pending:
+            return f"❌ Ошибка: неизвестный сервер {server}"
+        if self.pending[server] >= self.concurrency + self.max_queue:
+            telemetry.inc('ssh_rejected_total', server=server)
+            logger.warning(f"SSH: очередь команд для {server} переполнена")
+            return f"❌ Ошибка: сервер {server} перегружен, повторите позже"
+
+        if server not in self.semaphores:
+            self.semaphores[server] = asyncio.Semaphore(self.concurrency)
+        semaphore = self.semaphores[server]
+        self.pending[server] += 1
+        queued = time.perf_counter()
+        try:
+            await semaphore.acquire()
+        except BaseException:
+            self.pending[server] -= 1
+            raise
+        telemetry.observe('ssh_queue_wait_seconds', time.perf_counter() - queued, server=server)
+
+        def release(_) -> None:
+            semaphore.release()
+            self.pending[server] -= 1
+
+        # Место в очереди сервера освобождается, только когда поток действительно завершился:
+        # после таймаута он еще может ждать подключения, и без этого зависший хост занял бы все потоки
+        future = asyncio.get_running_loop().run_in_executor(self.threads, remote.run)
+        future.add_done_callback(release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), remote.timeout)
+        except asyncio.TimeoutError:
+            remote.cancel()
+            telemetry.inc('ssh_timeouts_total', server=server, kind=remote.kind)
+            logger.warning(f"SSH: превышено время выполнения на {server}: {remote.command}")
+            return f"❌ Ошибка: превышено время выполнения ({remote.timeout:g} с)"
+        except asyncio.CancelledError:
+            remote.cancel()
+            raise
+
+    def shutdown(self) -> None:
+        self.threads.shutdown(wait=False, cancel_futures=True)
+
+ssh_executor = SSHExecutor(
+    SSH_CONFIG,
+    concurrency=SSH_EXEC_CONFIG.get('concurrency', 4),
+    max_queue=SSH_EXEC_CONFIG.get('max_queue', 20),
+    timeout=SSH_EXEC_CONFIG.get('timeout', 300),
+    output_limit=SSH_EXEC_CONFIG.get('output_limit', 512 * 1024)
+)
+telemetry.gauge('ssh_queue_depth', lambda: [({'server': server}, count) for server, count in ssh_executor.pending.items()])
+
+class TTLCache:
+    def __init__(self, max_entries: int, ttl: float, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value, size = entry
+        if expires < time.monotonic():
+            self.discard(key)
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, size: int = 0) -> None:
+        self.discard(key)
+        self.entries[key] = (time.monotonic() + self.ttl, value, size)
+        self.size += size
+        # Вытесняем самые давно использованные записи, пока не уложимся в лимиты по числу и объему
+        while len(self.entries) > self.max_entries or (
+                self.max_bytes is not None and self.size > self.max_bytes and len(self.entries) > 1):
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, key) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    def invalidate(self, predicate) -> int:
+        keys = [key for key in self.entries if predicate(key)]
+        for key in keys:
+            self.discard(key)
+        return len(keys)
+
+class CommandCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.results = TTLCache(max_entries, ttl)
+        self.inflight = {}
+        self.generations = {}
+        self.stats = {'hits': 0, 'misses': 0, 'shared': 0, 'invalidated': 0}
+
+    async def run(self, server: str, command: str, execute):
+        key = (server, command)
+        result = self.results.get(key)
+        if result is not None:
+            self.stats['hits'] += 1
+            return result
+
+        task = self.inflight.get(key)
+        if task is not None:
+            # Такая же команда уже выполняется - ждем ее результат вместо повторного запуска
+            self.stats['shared'] += 1
+        else:
+            self.stats['misses'] += 1
+            task = self.inflight[key] = asyncio.create_task(
+                self.execute(key, execute, self.generations.get(server, 0)))
+            task.add_done_callback(lambda done: self.finish(key, done))
+        # Команда выполняется отдельной задачей, поэтому отмена одного из ждущих не отменяет ее для остальных
+        return await asyncio.shield(task)
+
+    async def execute(self, key, execute, generation: int):
+        result = await execute()
+        ok, output = result
+        # Если во время чтения сервер менялся, результат мог устареть и в кэш не попадает
+        if ok and self.generations.get(key[0], 0) == generation:
+            self.results.set(key, result)
+        return result
+
+    def finish(self, key, task: asyncio.Task) -> None:
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            task.exception()
+
+    def invalidate(self, server: str, keyword: str = '') -> None:
+        self.generations[server] = self.generations.get(server, 0) + 1
+        # Уже идущие чтения дорабатывают для своих ждущих, а новые запросы запускают команду заново
+        for key in [key for key in self.inflight if key[0] == server and keyword in key[1]]:
+            del self.inflight[key]
+        self.stats['invalidated'] += self.results.invalidate(
+            lambda key: key[0] == server and keyword in key[1]
+        )
+
+command_cache = CommandCache(COMMAND_CACHE_CONFIG.get('max_entries', 256), COMMAND_CACHE_CONFIG.get('ttl', 5))
+telemetry.gauge('command_cache_entries', lambda: [({}, len(command_cache.results.entries))])
+
+async def execute_checked(server: str, command: str, timeout: float = None):
+    remote = RemoteCommand(server, command, timeout or ssh_executor.timeout, ssh_executor.output_limit)
+    output = await ssh_executor.execute(remote)
+    # Код возврата есть только у команд, которые действительно выполнились на сервере
+    return remote.exit_status is not None, output
+
+async def run_ssh_command(server: str, command: str, timeout: float = None, cached: bool = False) -> str:
+    if cached:
+        ok, output = await command_cache.run(server, command, lambda: execute_checked(server, command, timeout))
+        return output
+    return await ssh_executor.run(server, command, timeout)
+
+def tail_text(text: str, limit: int = MESSAGE_OUTPUT_LIMIT) -> str:
+    if len(text) <= limit:
+        return text
+    return "...\n" + text[-limit:]
+
+async def stream_ssh_command(message: Message, server: str, command: str, title: str,
+                             timeout: float = None) -> str:
+    remote = RemoteCommand(server, command, timeout or ssh_executor.timeout, ssh_executor.output_limit)
+
+    async def push_updates():
+        shown = None
+        while True:
+            await asyncio.sleep(STREAM_EDIT_INTERVAL)
+            text = remote.output_text()
+            if not text or text == shown:
+                continue
+            try:
+                await message.edit_text(f"{title}\n```\n{tail_text(text)}\n```\n⏳ Выполняется...",
+                                        parse_mode='Markdown')
+                shown = text
+            except TelegramBadRequest as e:
+                logger.warning(f"Не удалось обновить сообщение с выводом: {e}")
+
+    updater = asyncio.create_task(push_updates())
+    try:
+        return await ssh_executor.execute(remote)
+    finally:
+        updater.cancel()
+
+output_pages = TTLCache(PAGER_CONFIG.get('max_entries', 512), PAGER_CONFIG.get('ttl', 1800),
+                        PAGER_CONFIG.get('max_bytes', 8 * 1024 * 1024))
+telemetry.gauge('pager_cache_bytes', lambda: [({}, output_pages.size)])
+
+def split_pages(text: str, page_size: int) -> list:
+    pages = []
+    current = []
+    length = 0
+    for line in text.splitlines():
+        while len(line) > page_size:
+            pages.append(line[:page_size])
+            line = line[page_size:]
+        if current and length + len(line) + 1 > page_size:
+            pages.append('\n'.join(current))
+            current, length = [], 0
+        current.append(line)
+        length += len(line) + 1
+    if current or not pages:
+        pages.append('\n'.join(current))
+    return pages
+
+def render_output_page(token: str, entry, page: int):
+    title, text, filename, extra_rows = entry
+    pages = split_pages(text, PAGER_CONFIG.get('page_size', 3000))
+    page = min(max(page, 0), len(pages) - 1)
+    # На крайних страницах стрелки никуда не ведут
+    navigation = [
+        InlineKeyboardButton(text="◀", callback_data=f'page_{token}_{page - 1}') if page > 0
+        else InlineKeyboardButton(text="·", callback_data='noop'),
+        InlineKeyboardButton(text=f"{page + 1}/{len(pages)}", callback_data='noop'),
+        InlineKeyboardButton(text="▶", callback_data=f'page_{token}_{page + 1}') if page < len(pages) - 1
+        else InlineKeyboardButton(text="·", callback_data='noop'),
+    ]
+    keyboard = [navigation, [InlineKeyboardButton(text="📥 Скачать целиком", callback_data=f'pagefile_{token}')],
+                *extra_rows]
+    return f"{title}\n```\n{pages[page]}\n```", InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+async def show_output(message: Message, title: str, text: str, filename: str, extra_rows=None) -> None:
+    extra_rows = extra_rows or []
+    if len(text) <= PAGER_CONFIG.get('page_size', 3000):
+        await message.edit_text(f"{title}\n```\n{text}\n```", reply_markup=InlineKeyboardMarkup(inline_keyboard=extra_rows),
+                                parse_mode='Markdown')
+        return
+    # Полный вывод остается в кэше: листание и выгрузка файлом не запускают команду заново
+    token = secrets.token_hex(4)
+    entry = (title, text, filename, extra_rows)
+    output_pages.set(token, entry, len(text.encode('utf-8')))
+    page_text, markup = render_output_page(token, entry, 0)
+    await message.edit_text(page_text, reply_markup=markup, parse_mode='Markdown')
+
+async def pool_maintenance() -> None:
+    while True:
+        await asyncio.sleep(60)
+        await asyncio.to_thread(ssh_pool.evict_idle)
+        logger.info(f"SSH пул: {ssh_pool.get_stats()}")
+
+async def run_on_servers(servers, command: str, timeout: float = None, cached: bool = False) -> dict:
+    semaphore = asyncio.Semaphore(FANOUT_CONFIG.get('concurrency', 20))
+    timeout = timeout or FANOUT_CONFIG.get('timeout', 30)
+
+    async def run_one(server):
+        async with semaphore:
+            if cached:
+                return server, await command_cache.run(server, command,
+                                                       lambda: execute_checked(server, command, timeout))
+            return server, await execute_checked(server, command, timeout)
+
+    return dict(await asyncio.gather(*(run_one(server) for server in servers)))
+
+def format_table(headers, rows) -> str:
+    widths = [max(len(str(row[i])) for row in [headers, *rows]) for i in range(len(headers))]
+    lines = ['  '.join(str(value).ljust(width) for value, width in zip(row, widths)).rstrip()
+             for row in [headers, *rows]]
+    return '\n'.join(lines)
+
+def format_fanout_summary(results: dict, headers, parse_row) -> str:
+    rows = []
+    failed = []
+    for server, (ok, output) in results.items():
+        try:
+            if not ok:
+                raise ValueError(output)
+            rows.append([server, *parse_row(output)])
+        except (ValueError, IndexError):
+            reason = output.lstrip('❌ ').splitlines()[0] if output.strip() else 'нет ответа'
+            failed.append(f"❌ {server}: {reason}")
+    text = format_table(['Сервер', *headers], rows) if rows else 'Нет данных'
+    if failed:
+        text += '\n\n' + '\n'.join(failed)
+    return text
+
+def parse_service_row(output: str) -> list:
+    state = output.split()[0]
+    emoji = '🟢' if state == 'active' else '🔴'
+    return [f"{emoji} {state}"]
+
+STATUS_VIEWS = {
+    'check_disk': ('💾 Использование диска', 'disk', ['Диск', 'Занято', 'Свободно']),
+    'check_memory': ('🧠 Использование памяти', 'memory', ['Память', 'Занято', 'Доступно']),
+    'check_load': ('📊 Нагрузка системы', 'load', ['1м', '5м', '15м', 'CPU', 'Ядер']),
+}
+
+selected_servers = {}
+
+def get_target_servers(user_id: int) -> list:
+    selected = selected_servers.get(user_id)
+    if selected == ALL_SERVERS:
+        return list(SSH_CONFIG)
+    if selected in SSH_CONFIG:
+        return [selected]
+    return [next(iter(SSH_CONFIG))]
+
+def get_server(user_id: int) -> str:
+    return get_target_servers(user_id)[0]
+
+def is_all_servers(user_id: int) -> bool:
+    return selected_servers.get(user_id) == ALL_SERVERS
+
+async def require_single_server(callback: CallbackQuery, action: str, extra_rows=None) -> Optional[str]:
+    # Действия с одним объектом не выполняются молча на первом сервере, если выбраны все
+    if is_all_servers(callback.from_user.id):
+        keyboard = [*(extra_rows or []), get_server_button(callback.from_user.id)]
+        await callback.message.edit_text(f'⚠️ {action} выполняется на одном сервере. Выберите сервер:',
+                                         reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+        return None
+    return get_server(callback.from_user.id)
+
+def get_server_button(user_id: int) -> list:
+    selected = selected_servers.get(user_id)
+    title = "Все серверы" if selected == ALL_SERVERS else get_server(user_id)
+    return [InlineKeyboardButton(text=f"🖥 Сервер: {title}", callback_data='select_server')]
+
+DOCKER_LOG_FILTERS = ('name', 'label', 'status', 'health', 'id', 'ancestor', 'network')
+
+DOCKER_LOG_PRESETS = {
+    'all': ('📦 Все контейнеры', []),
+    'running': ('🟢 Запущенные', [('status', 'running')]),
+    'exited': ('🔴 Остановленные', [('status', 'exited')]),
+    'unhealthy': ('🟡 Unhealthy', [('health', 'unhealthy')]),
+}
+
+def build_docker_logs_command(filters, tail: int, marker: str) -> str:
+    filter_args = ' '.join(f"--filter {shlex.quote(f'{key}={value}')}" for key, value in filters)
+    # Логи всех контейнеров собираются одним вызовом и сжимаются на сервере перед передачей
+    return (
+        f"docker ps -a {filter_args} --format '{{{{.Names}}}}' | while read -r name; do "
+        f"printf '\\n{marker} %s\\n' \"$name\"; docker logs --tail {int(tail)} \"$name\" 2>&1; "
+        f"done | gzip -c"
+    )
+
+def split_docker_logs(output: str, marker: str) -> dict:
+    logs = {}
+    for section in output.split(f"\n{marker} ")[1:]:
+        name, _, content = section.partition('\n')
+        logs[name] = content
+    return logs
+
+async def collect_docker_logs(server: str, filters=(), tail: int = 50) -> dict:
+    marker = f"@@docker-logs-{secrets.token_hex(8)}@@"
+    max_bytes = DOCKER_LOGS_CONFIG.get('max_bytes', 16 * 1024 * 1024)
+    remote = RemoteCommand(server, build_docker_logs_command(filters, tail, marker),
+                           DOCKER_LOGS_CONFIG.get('timeout', 120), max_bytes)
+    output = await ssh_executor.execute(remote)
+    if remote.exit_status is None:
+        raise RuntimeError(output)
+    if remote.stdout.truncated:
+        raise RuntimeError(f"архив логов больше {max_bytes} байт, уточните фильтр")
+
+    data = remote.stdout.getvalue()
+    if not data:
+        raise RuntimeError(remote.stderr.text().strip() or "пустой ответ сервера")
+    text = zlib.decompressobj(wbits=31).decompress(data).decode('utf-8', errors='replace')
+    return split_docker_logs(text, marker)
+
+def parse_docker_log_filters(args):
+    filters = []
+    tail = DOCKER_LOGS_CONFIG.get('tail', 50)
+    for arg in args:
+        key, _, value = arg.partition('=')
+        if key == 'tail' and value.isdigit():
+            tail = int(value)
+        elif key in DOCKER_LOG_FILTERS and value:
+            filters.append((key, value))
+        else:
+            raise ValueError(arg)
+    return filters, tail
+
+async def send_docker_logs(message: Message, servers, filters, tail: int) -> str:
+    results = await asyncio.gather(*(collect_docker_logs(server, filters, tail) for server in servers),
+                                   return_exceptions=True)
+
+    archive = io.BytesIO()
+    errors = []
+    count = 0
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for server, logs in zip(servers, results):
+            if isinstance(logs, Exception):
+                errors.append(f"❌ {server}: {logs}")
+                continue
+            for container, content in logs.items():
+                zip_file.writestr(f"{server}/{container}.log", content)
+                count += 1
+
+    if count:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        await message.answer_document(
+            document=BufferedInputFile(archive.getvalue(), filename=f"Docker_{timestamp}.zip"),
+            caption=f"📋 Docker логи от {timestamp} ({count} контейнеров)"
+        )
+
+    text = f'✅ Логи Docker отправлены: {count} контейнеров.' if count else '⚠️ Подходящих контейнеров не найдено.'
+    if errors:
+        text += '\n\n' + '\n'.join(errors)
+    return text
+
+# Из docker inspect берутся только нужные поля, по строке JSON на контейнер
+CONTAINER_INSPECT_FORMAT = (
+    '{"Id":{{json .Id}},"Name":{{json .Name}},"Image":{{json .Config.Image}},'
+    '"Status":{{json .State.Status}},"ExitCode":{{json .State.ExitCode}},"StartedAt":{{json .State.StartedAt}},'
+    '"Health":{{if .State.Health}}{{json .State.Health.Status}}{{else}}null{{end}},'
+    '"RestartCount":{{json .RestartCount}}}'
+)
+
+class ContainerInventory:
+    seed_command = ("date +%s; ids=$(docker ps -aq); "
+                    f"if [ -n \"$ids\" ]; then docker inspect --format {shlex.quote(CONTAINER_INSPECT_FORMAT)} $ids; "
+                    "fi")
+
+    def __init__(self, server: str):
+        self.server = server
+        self.containers = {}
+        self.lock = threading.Lock()
+        self.synced_at = None
+        self.connected = False
+        self.stopped = threading.Event()
+        self.channel = None
+
+    @property
+    def ready(self) -> bool:
+        return self.synced_at is not None
+
+    def load_snapshot(self, output: str) -> str:
+        since, _, payload = output.partition('\n')
+        containers = {}
+        for line in payload.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            container = ContainerState(
+                id=item['Id'],
+                name=item['Name'].lstrip('/'),
+                image=item['Image'],
+                status=item['Status'],
+                exit_code=item.get('ExitCode'),
+                started_at=parse_docker_time(item.get('StartedAt')),
+                health=item.get('Health'),
+                restart_count=item.get('RestartCount', 0)
+            )
+            containers[container.id] = container
+        with self.lock:
+            self.containers = containers
+            self.synced_at = time.time()
+        return since.strip()
+
+    def apply_event(self, event: dict) -> None:
+        action = event.get('Action', '')
+        actor = event.get('Actor', {})
+        container_id = actor.get('ID', '')
+        attributes = actor.get('Attributes', {})
+        event_time = datetime.fromtimestamp(event.get('time', time.time()), timezone.utc)
+
+        with self.lock:
+            container = self.containers.get(container_id)
+            if action == 'create':
+                self.containers[container_id] = ContainerState(
+                    id=container_id, name=attributes.get('name', container_id[:12]),
+                    image=attributes.get('image', ''), status='created'
+                )
+            elif container is None:
+                return
+            elif action == 'destroy':
+                del self.containers[container_id]
+            elif action in ('start', 'restart', 'unpause'):
+                if action != 'unpause':
+                    container.started_at = event_time
+                container.status = 'running'
+                container.exit_code = None
+            elif action == 'die':
+                container.status = 'exited'
+                container.exit_code = int(attributes.get('exitCode', 0))
+                container.health = None
+            elif action == 'pause':
+                container.status = 'paused'
+            elif action == 'rename':
+                container.name = attributes.get('name', container.name)
+            elif action.startswith('health_status:'):
+                container.health = action.split(':', 1)[1].strip()
+
+    def sync(self) -> str:
+        remote = RemoteCommand(self.server, self.seed_command, DOCKER_INVENTORY_CONFIG.get('timeout', 60),
+                               ssh_executor.output_limit * 4)
+        output = remote.run()
+        if remote.exit_status != 0:
+            raise RuntimeError(output)
+        if remote.stdout.truncated:
+            raise RuntimeError(f"список контейнеров больше {format_bytes(remote.stdout.limit)}, "
+                               "увеличьте SSH_EXEC.output_limit")
+        return self.load_snapshot(remote.stdout.text())
+
+    def follow(self) -> None:
+        delay = 5
+        while not self.stopped.is_set():
+            try:
+                since = self.sync()
+                with ssh_pool.session(self.server) as channel:
+                    self.channel = channel
+                    channel.exec_command(
+                        f"docker events --since {shlex.quote(since)} --filter type=container --format '{{{{json .}}}}'"
+                    )
+                    self.connected = True
+                    delay = 5
+                    logger.info(f"Docker: подписка на события {self.server} установлена")
+                    for line in channel.makefile('r'):
+                        self.apply_event(json.loads(line))
+            except Exception as e:
+                if not self.stopped.is_set():
+                    logger.warning(f"Docker: события {self.server} недоступны: {e}")
+            finally:
+                self.connected = False
+                self.channel = None
+            # После переподключения состояние заново синхронизируется через docker inspect
+            self.stopped.wait(delay)
+            delay = min(delay * 2, 300)
+
+    def start(self) -> None:
+        threading.Thread(target=self.follow, name=f'docker-events-{self.server}', daemon=True).start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.channel is not None:
+            self.channel.close()
+
+    async def ensure_ready(self) -> None:
+        # Без потока событий данные перечитываются, если они старше max_age
+        stale = not self.connected and self.ready and \
+            time.time() - self.synced_at > DOCKER_INVENTORY_CONFIG.get('max_age', 30)
+        if not self.ready or stale:
+            await asyncio.get_running_loop().run_in_executor(ssh_executor.threads, self.sync)
+
+    def invalidate(self) -> None:
+        # При живом потоке событий состояние обновится само, иначе перечитывается при следующем открытии
+        if not self.connected:
+            self.synced_at = None
+
+    def snapshot(self) -> list:
+        with self.lock:
+            return sorted(self.containers.values(), key=lambda container: container.name)
+
+    def find(self, name: str) -> Optional[ContainerState]:
+        with self.lock:
+            return next((container for container in self.containers.values() if container.name == name), None)
+
+    def staleness(self) -> str:
+        if self.connected:
+            return ''
+        age = format_duration(time.time() - self.synced_at) if self.synced_at else '?'
+        return f"\n\n⚠️ Нет потока событий Docker, данные могли устареть (синхронизация {age} назад)"
+
+container_inventories = {server: ContainerInventory(server) for server in SSH_CONFIG}
+
+class RingBuffer:
+    def __init__(self, capacity: int, columns: int = 1):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.columns = [array('d', bytes(8 * capacity)) for _ in range(columns)]
+        self.start = 0
+        self.count = 0
+
+    def append(self, timestamp: float, *values) -> None:
+        index = (self.start + self.count) % self.capacity
+        if self.count == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+        else:
+            self.count += 1
+        self.times[index] = timestamp
+        for column, value in zip(self.columns, values):
+            column[index] = value
+
+    def since(self, timestamp: float) -> list:
+        rows = []
+        for offset in range(self.count):
+            index = (self.start + offset) % self.capacity
+            if self.times[index] >= timestamp:
+                rows.append(tuple(column[index] for column in self.columns))
+        return rows
+
+    def span(self, timestamp: float):
+        first = None
+        for offset in range(self.count):
+            index = (self.start + offset) % self.capacity
+            if self.times[index] >= timestamp:
+                first = (self.times[index], self.columns[0][index])
+                break
+        if first is None:
+            return None
+        last = (self.start + self.count - 1) % self.capacity
+        return first, (self.times[last], self.columns[0][last])
+
+class MetricHistory:
+    # Шаг (в секундах) и емкость уровней прореживания: 1 минута - сутки, 5 минут - неделя, 1 час - месяц
+    tiers = ((60, 1440), (300, 2016), (3600, 720))
+
+    def __init__(self, interval: float, raw_points: int):
+        self.raw = RingBuffer(raw_points)
+        self.raw_span = interval * raw_points
+        self.downsampled = [(step, RingBuffer(capacity, 3)) for step, capacity in self.tiers]
+        self.buckets = [None] * len(self.tiers)
+
+    def add(self, timestamp: float, value: float) -> None:
+        self.raw.append(timestamp, value)
+        for i, (step, buffer) in enumerate(self.downsampled):
+            bucket_start = timestamp - timestamp % step
+            bucket = self.buckets[i]
+            if bucket is not None and bucket[0] != bucket_start:
+                start, total, count, low, high = bucket
+                buffer.append(start, total / count, low, high)
+                bucket = None
+            if bucket is None:
+                self.buckets[i] = [bucket_start, value, 1, value, value]
+            else:
+                bucket[1] += value
+                bucket[2] += 1
+                bucket[3] = min(bucket[3], value)
+                bucket[4] = max(bucket[4], value)
+
+    def stats(self, window: float) -> Optional[dict]:
+        since = time.time() - window
+        if window <= self.raw_span:
+            rows = [(value, value, value) for value, in self.raw.since(since)]
+        else:
+            tier = next((i for i, (step, buffer) in enumerate(self.downsampled)
+                         if step * buffer.capacity >= window), len(self.downsampled) - 1)
+            step, buffer = self.downsampled[tier]
+            rows = buffer.since(since - step)
+            bucket = self.buckets[tier]
+            if bucket is not None:
+                rows.append((bucket[1] / bucket[2], bucket[3], bucket[4]))
+        if not rows:
+            return None
+        averages = sorted(row[0] for row in rows)
+        return {
+            'min': min(row[1] for row in rows),
+            'avg': sum(averages) / len(averages),
+            'max': max(row[2] for row in rows),
+            'p95': averages[max(0, math.ceil(0.95 * len(averages)) - 1)],
+            'points': len(rows)
+        }
+
+    def rate(self, window: float) -> Optional[float]:
+        span = self.raw.span(time.time() - window)
+        if span is None:
+            return None
+        (first_time, first_value), (last_time, last_value) = span
+        # Скорость считается только если замеры покрывают хотя бы половину окна
+        if last_time - first_time < window / 2:
+            return None
+        return (last_value - first_value) * 3600 / (last_time - first_time)
+
+@dataclass
+class MountUsage:
+    mount: str
+    total: int
+    used: int
+    available: int
+
+    @property
+    def percent(self) -> float:
+        return self.used * 100 / max(self.used + self.available, 1)
+
+@dataclass
+class UnitState:
+    name: str
+    load_state: str
+    active_state: str
+    sub_state: str
+
+@dataclass
+class HostSnapshot:
+    load: tuple
+    cores: int
+    cpu_total: int
+    cpu_idle: int
+    mem_total: int
+    mem_available: int
+    swap_total: int
+    swap_free: int
+    mounts: list
+    units: dict
+    cpu_percent: Optional[float] = None
+
+    @property
+    def mem_used(self) -> int:
+        return self.mem_total - self.mem_available
+
+    @property
+    def mem_percent(self) -> float:
+        return self.mem_used * 100 / max(self.mem_total, 1)
+
+PROBE_FILESYSTEMS = 'ext2|ext3|ext4|xfs|btrfs|zfs|f2fs|vfat|jfs|reiserfs|nfs|nfs4|cifs'
+
+def build_probe_command(units) -> str:
+    # Один вызов читает /proc и statfs напрямую, без top/free/df
+    unit_args = ' '.join(shlex.quote(unit) for unit in units)
+    script = (
+        "echo '@loadavg'; cat /proc/loadavg; "
+        "echo '@cpu'; head -n 1 /proc/stat; grep -c '^cpu[0-9]' /proc/stat; "
+        "echo '@meminfo'; grep -E '^(MemTotal|MemAvailable|SwapTotal|SwapFree):' /proc/meminfo; "
+        "echo '@mounts'; while read -r dev mnt fstype rest; do case \"$fstype\" in "
+        f"{PROBE_FILESYSTEMS}) stat -f -c \"%b %a %f %S $mnt\" \"$mnt\" 2>/dev/null;; esac; done < /proc/mounts; "
+        "echo '@units'"
+    )
+    if unit_args:
+        script += f"; systemctl show -p Id -p LoadState -p ActiveState -p SubState {unit_args} 2>/dev/null"
+    return script
+
+def parse_probe(output: str) -> HostSnapshot:
+    sections = {}
+    name = None
+    for line in output.splitlines():
+        if line.startswith('@'):
+            name = line[1:].strip()
+            sections[name] = []
+        elif name is not None:
+            sections[name].append(line)
+
+    load = tuple(float(value) for value in sections['loadavg'][0].split()[:3])
+    cpu = [int(value) for value in sections['cpu'][0].split()[1:]]
+    memory = {line.split(':')[0]: int(line.split()[1]) * 1024 for line in sections['meminfo']}
+
+    mounts = {}
+    for line in sections['mounts']:
+        blocks, available, free, block_size, mount = line.split(' ', 4)
+        total = int(blocks) * int(block_size)
+        if total and mount not in mounts:
+            used = total - int(free) * int(block_size)
+            mounts[mount] = MountUsage(mount.replace('\\040', ' '), total, used, int(available) * int(block_size))
+
+    units = {}
+    fields = {}
+    for line in sections.get('units', []) + ['']:
+        if '=' in line:
+            key, _, value = line.partition('=')
+            fields[key] = value
+        elif not line and fields.get('Id'):
+            unit_name = fields.get('Id', '').replace('.service', '')
+            units[unit_name] = UnitState(unit_name, fields.get('LoadState', ''),
+                                         fields.get('ActiveState', ''), fields.get('SubState', ''))
+        if not line:
+            fields = {}
+
+    return HostSnapshot(
+        load=load,
+        cores=int(sections['cpu'][1]),
+        cpu_total=sum(cpu[:8]),
+        # idle + iowait
+        cpu_idle=cpu[3] + cpu[4],
+        mem_total=memory['MemTotal'],
+        mem_available=memory['MemAvailable'],
+        swap_total=memory.get('SwapTotal', 0),
+        swap_free=memory.get('SwapFree', 0),
+        mounts=sorted(mounts.values(), key=lambda mount: mount.mount),
+        units=units
+    )
+
+PROBE_COMMAND = build_probe_command(MONITORED_UNITS)
+
+def snapshot_metrics(snapshot: HostSnapshot) -> dict:
+    metrics = {
+        'load1': snapshot.load[0],
+        'load_per_core': snapshot.load[0] / max(snapshot.cores, 1),
+        'mem_used_pct': snapshot.mem_percent
+    }
+    if snapshot.cpu_percent is not None:
+        metrics['cpu_pct'] = snapshot.cpu_percent
+    for mount in snapshot.mounts:
+        metrics[f'disk_pct:{mount.mount}'] = mount.percent
+    return metrics
+
+class MetricsStore:
+    def __init__(self, interval: float, raw_points: int):
+        self.interval = interval
+        self.raw_points = raw_points
+        self.history = {}
+        self.latest = {}
+        self.latest_metrics = {}
+
+    def record(self, server: str, timestamp: float, snapshot: HostSnapshot) -> None:
+        previous = self.latest.get(server)
+        if previous is not None:
+            # Загрузка CPU считается по разнице счетчиков /proc/stat между соседними замерами
+            total = snapshot.cpu_total - previous[1].cpu_total
+            idle = snapshot.cpu_idle - previous[1].cpu_idle
+            if total > 0:
+                snapshot.cpu_percent = 100 - idle * 100 / total
+        self.latest[server] = (timestamp, snapshot)
+        self.latest_metrics[server] = snapshot_metrics(snapshot)
+        for metric, value in self.latest_metrics[server].items():
+            history = self.history.get((server, metric))
+            if history is None:
+                history = self.history[(server, metric)] = MetricHistory(self.interval, self.raw_points)
+            history.add(timestamp, value)
+
+    def fresh_sample(self, server: str) -> Optional[HostSnapshot]:
+        timestamp, snapshot = self.latest.get(server, (0, None))
+        if time.time() - timestamp > self.interval * 3:
+            return None
+        return snapshot
+
+    def metric_names(self, server: str, prefix: str) -> list:
+        return sorted(metric for (name, metric) in self.history if name == server and metric.startswith(prefix))
+
+    def stats(self, server: str, metric: str, window: float) -> Optional[dict]:
+        history = self.history.get((server, metric))
+        return history.stats(window) if history else None
+
+metrics_store = MetricsStore(METRICS_CONFIG.get('interval', 15), METRICS_CONFIG.get('raw_points', 240))
+
+async def probe_servers(servers, timeout: float = None, cached: bool = False) -> dict:
+    results = await run_on_servers(servers, PROBE_COMMAND, timeout, cached)
+    snapshots = {}
+    for server, (ok, output) in results.items():
+        if not ok:
+            snapshots[server] = output.lstrip('❌ ').splitlines()[0] if output.strip() else 'нет ответа'
+            continue
+        try:
+            snapshots[server] = parse_probe(output)
+        except (ValueError, IndexError, KeyError) as e:
+            logger.warning(f"Метрики: не удалось разобрать ответ {server}: {e}")
+            snapshots[server] = f"некорректный ответ ({e})"
+    return snapshots
+
+async def get_snapshots(servers) -> dict:
+    snapshots = {server: metrics_store.fresh_sample(server) for server in servers}
+    missing = [server for server, snapshot in snapshots.items() if snapshot is None]
+    if missing:
+        snapshots.update(await probe_servers(missing, cached=True))
+    return snapshots
+
+async def metrics_sampler() -> None:
+    notifications = set()
+    while True:
+        started = time.monotonic()
+        try:
+            snapshots = await probe_servers(list(SSH_CONFIG), timeout=metrics_store.interval)
+            timestamp = time.time()
+            for server, snapshot in snapshots.items():
+                if isinstance(snapshot, HostSnapshot):
+                    metrics_store.record(server, timestamp, snapshot)
+            if ALERTS_CONFIG.get('enabled', True):
+                events = alert_engine.evaluate(timestamp)
+                if events:
+                    task = asyncio.create_task(notify_admins(format_alerts(events)))
+                    notifications.add(task)
+                    task.add_done_callback(notifications.discard)
+        except Exception as e:
+            # Ошибка одного цикла не должна останавливать сбор метрик и оповещения
+            logger.exception(f"Ошибка сбора метрик: {e}")
+        await asyncio.sleep(max(0, metrics_store.interval - (time.monotonic() - started)))
+
+def format_bytes(value: float) -> str:
+    for unit in ('B', 'K', 'M', 'G', 'T'):
+        if abs(value) < 1024 or unit == 'T':
+            return f"{value:.0f}{unit}" if unit in ('B', 'K') else f"{value:.1f}{unit}"
+        value /= 1024
+
+def format_cpu(snapshot: HostSnapshot) -> str:
+    return '-' if snapshot.cpu_percent is None else f"{snapshot.cpu_percent:.0f}%"
+
+def format_sample_details(kind: str, snapshot: HostSnapshot) -> str:
+    if kind == 'disk':
+        rows = [[mount.mount, format_bytes(mount.total), format_bytes(mount.used),
+                 format_bytes(mount.available), f"{mount.percent:.0f}%"]
+                for mount in snapshot.mounts]
+        return format_table(['Раздел', 'Размер', 'Занято', 'Свободно', '%'], rows)
+    if kind == 'memory':
+        rows = [['RAM', format_bytes(snapshot.mem_total), format_bytes(snapshot.mem_used),
+                 format_bytes(snapshot.mem_available), f"{snapshot.mem_percent:.0f}%"]]
+        if snapshot.swap_total:
+            swap_used = snapshot.swap_total - snapshot.swap_free
+            rows.append(['Swap', format_bytes(snapshot.swap_total), format_bytes(swap_used),
+                         format_bytes(snapshot.swap_free), f"{swap_used * 100 / snapshot.swap_total:.0f}%"])
+        return format_table(['', 'Всего', 'Занято', 'Доступно', '%'], rows)
+    return format_table(['1м', '5м', '15м', 'CPU', 'Ядер'],
+                        [[*(f"{value:.2f}" for value in snapshot.load), format_cpu(snapshot), snapshot.cores]])
+
+def format_sample_row(kind: str, snapshot: HostSnapshot) -> list:
+    if kind == 'disk':
+        root = next((mount for mount in snapshot.mounts if mount.mount == '/'), None)
+        if root is None:
+            return ['-', '-', '-']
+        return [f"{root.percent:.0f}%", f"{format_bytes(root.used)}/{format_bytes(root.total)}",
+                format_bytes(root.available)]
+    if kind == 'memory':
+        return [f"{snapshot.mem_percent:.0f}%", f"{format_bytes(snapshot.mem_used)}/{format_bytes(snapshot.mem_total)}",
+                format_bytes(snapshot.mem_available)]
+    return [*(f"{value:.2f}" for value in snapshot.load), format_cpu(snapshot), snapshot.cores]
+
+def format_snapshot_summary(snapshots: dict, headers, make_row) -> str:
+    rows = []
+    failed = []
+    for server, snapshot in snapshots.items():
+        if isinstance(snapshot, HostSnapshot):
+            rows.append([server, *make_row(snapshot)])
+        else:
+            failed.append(f"❌ {server}: {snapshot}")
+    text = format_table(['Сервер', *headers], rows) if rows else 'Нет данных'
+    if failed:
+        text += '\n\n' + '\n'.join(failed)
+    return text
+
+def format_unit_row(snapshot: HostSnapshot, service: str) -> list:
+    unit = snapshot.units.get(service)
+    if unit is None or unit.load_state == 'not-found':
+        return ['❓ не найден']
+    emoji = '🟢' if unit.active_state == 'active' else '🔴'
+    return [f"{emoji} {unit.active_state} ({unit.sub_state})"]
+
+HISTORY_WINDOWS = {'hour': ('час', 3600), 'day': ('сутки', 86400)}
+
+def format_history(server: str, kind: str, window: float) -> str:
+    if kind == 'disk':
+        metrics = [(metric.split(':', 1)[1], metric) for metric in metrics_store.metric_names(server, 'disk_pct:')]
+    elif kind == 'memory':
+        metrics = [('Память, %', 'mem_used_pct')]
+    else:
+        metrics = [('Load 1м', 'load1'), ('На ядро', 'load_per_core'), ('CPU, %', 'cpu_pct')]
+    rows = []
+    for title, metric in metrics:
+        stats = metrics_store.stats(server, metric, window)
+        if stats:
+            rows.append([title, *(f"{stats[key]:.2f}" for key in ('min', 'avg', 'max', 'p95'))])
+    if not rows:
+        return 'Нет данных за этот период'
+    return format_table(['Метрика', 'мин', 'сред', 'макс', 'p95'], rows)
+
+def get_history_keyboard(kind: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text=f"📈 За {title}", callback_data=f'history_{kind}_{window}')
+        for window, (title, seconds) in HISTORY_WINDOWS.items()
+    ]])
+
+DEFAULT_ALERT_RULES = [
+    {'name': 'disk', 'title': 'Диск заполнен', 'metric': 'disk_pct:*', 'op': '>', 'threshold': 90, 'clear': 85,
+     'unit': '%'},
+    {'name': 'disk_growth', 'title': 'Диск быстро заполняется', 'metric': 'disk_pct:*', 'rate_window': 3600,
+     'op': '>', 'threshold': 5, 'clear': 2, 'unit': '%/ч'},
+    {'name': 'load', 'title': 'Высокая нагрузка на ядро', 'metric': 'load_per_core', 'op': '>', 'threshold': 2,
+     'clear': 1.5, 'for': 300},
+    {'name': 'memory', 'title': 'Мало доступной памяти', 'metric': 'mem_used_pct', 'op': '>', 'threshold': 90,
+     'clear': 85, 'unit': '%'},
+    {'name': 'unit', 'title': 'Сервис не активен', 'type': 'unit'},
+    {'name': 'container', 'title': 'Контейнер остановлен', 'type': 'container', 'notify_initial': False},
+]
+
+@dataclass
+class AlertEvent:
+    server: str
+    rule: dict
+    subject: str
+    firing: bool
+    value: Optional[str]
+
+class AlertEngine:
+    def __init__(self, rules, cooldown: float):
+        self.rules = rules
+        self.cooldown = cooldown
+        self.states = {}
+
+    def check_threshold(self, rule: dict, value: float, firing: bool) -> bool:
+        above = rule.get('op', '>') == '>'
+        threshold = rule['threshold']
+        clear = rule.get('clear', threshold)
+        if firing:
+            return value > clear if above else value < clear
+        return value > threshold if above else value < threshold
+
+    def metric_values(self, rule: dict, server: str):
+        pattern = rule['metric']
+        names = [name for name in metrics_store.latest_metrics.get(server, {})
+                 if name == pattern or pattern.endswith('*') and name.startswith(pattern[:-1])]
+        for name in names:
+            if 'rate_window' in rule:
+                history = metrics_store.history.get((server, name))
+                value = history.rate(rule['rate_window']) if history else None
+            else:
+                value = metrics_store.latest_metrics[server][name]
+            if value is not None:
+                subject = name.split(':', 1)[1] if ':' in name else ''
+                yield subject, value, f"{value:.1f}{rule.get('unit', '')}"
+
+    def observations(self, rule: dict, server: str):
+        # Возвращает (объект, сработало ли правило, значение) с учетом гистерезиса для метрик
+        rule_type = rule.get('type', 'metric')
+        if rule_type == 'unit':
+            snapshot = metrics_store.latest.get(server, (0, None))[1]
+            for unit in (snapshot.units.values() if snapshot else ()):
+                if unit.load_state != 'not-found':
+                    yield unit.name, unit.active_state not in ('active', 'activating', 'reloading'), \
+                        f"{unit.active_state} ({unit.sub_state})"
+        elif rule_type == 'container':
+            inventory = container_inventories.get(server)
+            for container in (inventory.snapshot() if inventory and inventory.ready else ()):
+                yield container.name, container.status in ('exited', 'dead'), format_container_status(container)
+        else:
+            for subject, value, text in self.metric_values(rule, server):
+                state = self.states.get((rule['name'], server, subject))
+                yield subject, self.check_threshold(rule, value, bool(state and state['firing'])), text
+
+    def has_data(self, rule: dict, server: str) -> bool:
+        rule_type = rule.get('type', 'metric')
+        if rule_type == 'unit':
+            return server in metrics_store.latest
+        if rule_type == 'container':
+            inventory = container_inventories.get(server)
+            return bool(inventory and inventory.ready)
+        return server in metrics_store.latest_metrics
+
+    def evaluate(self, now: float) -> list:
+        events = []
+        observed = set()
+        for server in SSH_CONFIG:
+            for rule in self.rules:
+                if not self.has_data(rule, server):
+                    # Без данных состояние не сбрасывается, иначе при сбое опроса придут ложные восстановления
+                    observed.update(key for key in self.states if key[:2] == (rule['name'], server))
+                    continue
+                for subject, active, value in self.observations(rule, server):
+                    key = (rule['name'], server, subject)
+                    observed.add(key)
+                    event = self.update(key, rule, active, now)
+                    if event is not None:
+                        events.append(AlertEvent(server, rule, subject, event, value))
+        # Удаленные контейнеры, сервисы и разделы забываются, о сработавших сообщается как о восстановленных
+        rules = {rule['name']: rule for rule in self.rules}
+        for key in [key for key in self.states if key not in observed]:
+            state = self.states.pop(key)
+            if state['firing'] and state['notified'] and key[0] in rules:
+                events.append(AlertEvent(key[1], rules[key[0]], key[2], False, None))
+        return events
+
+    def update(self, key, rule: dict, active: bool, now: float) -> Optional[bool]:
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = {'firing': False, 'pending_since': None,
+                                        'last_notified': None, 'notified': False}
+            if active and not rule.get('notify_initial', True):
+                state['firing'] = True
+                return None
+
+        if state['firing']:
+            if active:
+                return None
+            state['firing'] = False
+            state['pending_since'] = None
+            # Восстановление сообщается только если о срабатывании было оповещение
+            notified, state['notified'] = state['notified'], False
+            return False if notified else None
+
+        if not active:
+            state['pending_since'] = None
+            return None
+        if state['pending_since'] is None:
+            state['pending_since'] = now
+        if now - state['pending_since'] < rule.get('for', 0):
+            return None
+
+        state['firing'] = True
+        last_notified = state['last_notified']
+        if last_notified is not None and now - last_notified < rule.get('cooldown', self.cooldown):
+            return None
+        state['last_notified'] = now
+        state['notified'] = True
+        return True
+
+    def active(self) -> list:
+        return sorted(key for key, state in self.states.items() if state['firing'])
+
+def validate_alert_rule(rule) -> None:
+    if not isinstance(rule, dict) or not isinstance(rule.get('name'), str):
+        raise ValueError("нет имени правила")
+    rule_type = rule.get('type', 'metric')
+    if rule_type not in ('metric', 'unit', 'container'):
+        raise ValueError(f"неизвестный тип {rule_type}")
+    for key in ('for', 'cooldown'):
+        if not isinstance(rule.get(key, 0), (int, float)):
+            raise ValueError(f"{key} должен быть числом")
+    if rule_type != 'metric':
+        return
+    if not isinstance(rule.get('metric'), str):
+        raise ValueError("не указана метрика")
+    if rule.get('op', '>') not in ('>', '<'):
+        raise ValueError(f"неизвестный оператор {rule['op']}")
+    for key in ('threshold', 'clear', 'rate_window'):
+        if key in rule and not isinstance(rule[key], (int, float)):
+            raise ValueError(f"{key} должен быть числом")
+    if 'threshold' not in rule:
+        raise ValueError("не указан threshold")
+
+def load_alert_rules() -> list:
+    rules = []
+    for rule in ALERTS_CONFIG.get('rules', DEFAULT_ALERT_RULES):
+        try:
+            validate_alert_rule(rule)
+        except ValueError as e:
+            # Ошибочное правило пропускается, остальные продолжают работать
+            logger.error(f"Оповещения: правило {rule!r} пропущено: {e}")
+            continue
+        rule.setdefault('title', rule['name'])
+        rules.append(rule)
+    return rules
+
+alert_engine = AlertEngine(load_alert_rules(), ALERTS_CONFIG.get('cooldown', 900))
+
+def format_alerts(events) -> str:
+    by_server = {}
+    for event in events:
+        by_server.setdefault(event.server, []).append(event)
+    lines = [f"🚨 Оповещения ({len(events)})"]
+    for server, server_events in by_server.items():
+        lines.append(f"\n🖥 {server}")
+        for event in server_events:
+            emoji = '🔴' if event.firing else '✅'
+            subject = f" {event.subject}" if event.subject else ''
+            if event.value is None:
+                lines.append(f"{emoji} {event.rule['title']}{subject}: больше не наблюдается")
+                continue
+            status = '' if event.firing else ' - в норме'
+            lines.append(f"{emoji} {event.rule['title']}{subject}: {event.value}{status}")
+    text = '\n'.join(lines)
+    return text if len(text) <= MESSAGE_OUTPUT_LIMIT else text[:MESSAGE_OUTPUT_LIMIT] + '\n...'
+
+
+async def notify_admins(text: str) -> None:
+    async def notify(admin_id):
+        try:
+            await bot.send_message(admin_id, text)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить оповещение {admin_id}: {e}")
+
+    await asyncio.gather(*(notify(admin_id) for admin_id in ADMIN_IDS))
 
 async def show_loading(message: Message, text: str):
     await message.edit_text(f"{text}\n\n⏳ Загрузка...")
 
-async def save_and_send_log(message: Message, log_content: str, log_type: str) -> None:
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{log_type}_{timestamp}.log"
-    
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.log', encoding='utf-8') as temp_file:
-        temp_file.write(log_content)
-        temp_file.flush()
-        
+class StreamingRemoteCommand(RemoteCommand):
+    def __init__(self, server: str, command: str, timeout: float, queue: asyncio.Queue,
+                 loop: asyncio.AbstractEventLoop):
+        super().__init__(server, command, timeout, output_limit=64 * 1024)
+        self.queue = queue
+        self.loop = loop
+
+    def handle_stdout(self, data: bytes) -> None:
+        # Поток SSH ждет, пока потребитель освободит место в очереди, поэтому в памяти не больше maxsize блоков
+        future = asyncio.run_coroutine_threadsafe(self.queue.put(data), self.loop)
+        while True:
+            try:
+                future.result(timeout=1)
+                return
+            except concurrent.futures.TimeoutError:
+                if self.cancelled:
+                    future.cancel()
+                    raise RuntimeError("команда отменена")
+
+class SpooledInputFile(InputFile):
+    def __init__(self, file, filename: str):
+        super().__init__(filename=filename)
+        self.file = file
+
+    async def read(self, bot: Bot):
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+class CompressedLogUploader:
+    def __init__(self, message: Message, log_type: str, part_size: int, spool_size: int):
+        self.message = message
+        self.log_type = log_type
+        self.part_size = part_size
+        self.spool_size = spool_size
+        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.parts = 0
+        self.raw_bytes = 0
+        self.buffer = None
+
+    def start_part(self) -> None:
+        self.buffer = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self.part_raw_bytes = 0
+
+    async def write(self, data: bytes) -> None:
+        if self.buffer is None:
+            self.start_part()
+        self.buffer.write(self.compressor.compress(data))
+        self.part_raw_bytes += len(data)
+        self.raw_bytes += len(data)
+        if self.buffer.tell() >= self.part_size:
+            await self.flush(final=False)
+
+    async def flush(self, final: bool = True) -> None:
+        if self.buffer is None:
+            return
+        self.buffer.write(self.compressor.flush())
+        self.parts += 1
+        suffix = '' if final and self.parts == 1 else f"_part{self.parts}"
+        try:
+            await self.message.answer_document(
+                document=SpooledInputFile(self.buffer, f"{self.log_type}_{self.timestamp}{suffix}.log.gz"),
+                caption=f"📋 {self.log_type} лог от {self.timestamp}"
+                        f"{'' if not suffix else f', часть {self.parts}'} ({format_bytes(self.part_raw_bytes)})"
+            )
+        finally:
+            self.buffer.close()
+            self.buffer = None
+
+async def collect_log(server: str, command: str, semaphore: asyncio.Semaphore, write) -> Optional[str]:
+    loop = asyncio.get_running_loop()
+    async with semaphore:
+        queue = asyncio.Queue(maxsize=LOG_EXPORT_CONFIG.get('queue_chunks', 8))
+        remote = StreamingRemoteCommand(server, command, LOG_EXPORT_CONFIG.get('timeout', 600), queue, loop)
+
+        async def produce():
+            try:
+                output = await ssh_executor.execute(remote)
+            except asyncio.CancelledError:
+                # Потребитель уже не читает очередь, поэтому маркер конца кладется без ожидания
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                raise
+            await queue.put(None)
+            return output
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                await write(chunk)
+        except BaseException:
+            producer.cancel()
+            raise
+        output = await producer
+    if remote.exit_status is None or remote.stderr.text().strip():
+        return f"❌ {server}: {output.lstrip('❌ ').splitlines()[-1] if output.strip() else 'нет ответа'}"
+    return None
+
+async def buffer_log(server: str, command: str, semaphore: asyncio.Semaphore):
+    # Пока первый сервер отправляется, остальные копят вывод уже сжатым
+    spool = tempfile.SpooledTemporaryFile(max_size=LOG_EXPORT_CONFIG.get('spool_size', 1024 * 1024))
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    async def write(data: bytes) -> None:
+        spool.write(compressor.compress(data))
+
+    try:
+        error = await collect_log(server, command, semaphore, write)
+        spool.write(compressor.flush())
+    except BaseException:
+        spool.close()
+        raise
+    return spool, error
+
+async def replay_log(spool, uploader: CompressedLogUploader) -> None:
+    spool.seek(0)
+    decompressor = zlib.decompressobj(31)
+    while True:
+        chunk = spool.read(256 * 1024)
+        if not chunk:
+            break
+        data = decompressor.decompress(chunk, 1024 * 1024)
+        while data:
+            await uploader.write(data)
+            data = decompressor.decompress(decompressor.unconsumed_tail, 1024 * 1024)
+
+async def export_log(message: Message, servers, command: str, log_type: str) -> str:
+    uploader = CompressedLogUploader(
+        message, log_type,
+        part_size=LOG_EXPORT_CONFIG.get('part_size', 45 * 1024 * 1024),
+        spool_size=LOG_EXPORT_CONFIG.get('spool_size', 1024 * 1024)
+    )
+    # Первый сервер сжимается прямо в отправляемый файл, остальные читаются параллельно в сжатые буферы
+    semaphore = asyncio.Semaphore(FANOUT_CONFIG.get('concurrency', 20))
+    first, *rest = servers
+    tasks = [asyncio.create_task(buffer_log(server, command, semaphore)) for server in rest]
+    errors = []
+    try:
+        if rest:
+            await uploader.write(f"\n=== Сервер {first} ===\n".encode())
+        errors.append(await collect_log(first, command, semaphore, uploader.write))
+        for server, task in zip(rest, tasks):
+            spool, error = await task
+            with spool:
+                errors.append(error)
+                await uploader.write(f"\n=== Сервер {server} ===\n".encode())
+                await replay_log(spool, uploader)
+        await uploader.flush()
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, tuple):
+                result[0].close()
+        raise
+    errors = [error for error in errors if error]
+
+    if not uploader.parts:
+        text = '⚠️ Лог пуст.'
+    else:
+        text = f'✅ {log_type} логи отправлены: {format_bytes(uploader.raw_bytes)}, файлов: {uploader.parts}.'
+    if errors:
+        text += '\n\n' + '\n'.join(errors)
+    return text
+
+LOG_SOURCES = {
+    'logs_system': ("📊 Получение системных логов...", 'journalctl -n {lines} --no-pager', "Системные"),
+    'logs_nginx': ("🌐 Получение логов Nginx...",
+                   'tail -n {lines} /var/log/nginx/access.log /var/log/nginx/error.log', "Nginx"),
+    'logs_postgres': ("🗄 Получение логов PostgreSQL...",
+                      'tail -n {lines} /var/log/postgresql/postgresql-*.log', "PostgreSQL"),
+}
+
+JOURNAL_EXPORT_PERIODS = {
+    '2h': ('2 часа', '2 hours ago'),
+    '1d': ('сутки', '1 day ago'),
+}
+
+LOG_FOLLOW_SOURCES = {
+    'system': ("📊 Системные", None),
+    'nginx': ("🌐 Nginx", ['/var/log/nginx/access.log', '/var/log/nginx/error.log']),
+    'postgres': ("🗄 PostgreSQL", ['/var/log/postgresql/postgresql-*.log']),
+}
+
+LOG_PRIORITIES = ('emerg', 'alert', 'crit', 'err', 'warning', 'notice', 'info', 'debug')
+LOG_FILTER_KEYS = ('unit', 'priority', 'grep', 'since', 'until')
+
+log_cursors = {}
+log_filters = {}
+
+def parse_log_filters(args) -> dict:
+    filters = {}
+    for arg in args:
+        key, _, value = arg.partition('=')
+        if key not in LOG_FILTER_KEYS or not value:
+            raise ValueError(arg)
+        if key == 'priority' and value not in LOG_PRIORITIES and value not in '01234567':
+            raise ValueError(arg)
+        filters[key] = value
+    return filters
+
+def build_journal_follow_command(cursor: Optional[str], filters: dict, lines: int) -> str:
+    args = ['journalctl', '--no-pager', '--show-cursor']
+    args += ['--after-cursor', cursor] if cursor else ['-n', str(lines)]
+    if filters.get('unit'):
+        args += ['-u', filters['unit']]
+    if filters.get('priority'):
+        args += ['-p', filters['priority']]
+    if filters.get('grep'):
+        args += ['--grep', filters['grep']]
+    if filters.get('since'):
+        args += ['--since', filters['since']]
+    if filters.get('until'):
+        args += ['--until', filters['until']]
+    return ' '.join(shlex.quote(arg) for arg in args)
+
+def build_file_follow_command(patterns, cursors: Optional[dict], filters: dict, lines: int, marker: str) -> str:
+    # Позиция в файле - это inode и смещение. Если inode сменился, файл был ротирован:
+    # старый файл ищется по inode и дочитывается с сохраненного смещения, новый читается с начала
+    grep = f"grep -E -- {shlex.quote(filters['grep'])}" if filters.get('grep') else 'cat'
+    cases = ' '.join(f"{shlex.quote(path)}) old={inode}; off={offset};;"
+                     for path, (inode, offset) in (cursors or {}).items())
+    new_file = f"tail -n {int(lines)}" if cursors is None else 'cat'
+    return (
+        f"m={shlex.quote(marker)}; out=''; "
+        f"for f in {' '.join(patterns)}; do "
+        "[ -f \"$f\" ] || continue; "
+        "ino=$(stat -c %i \"$f\"); size=$(stat -c %s \"$f\"); old=''; off=0; "
+        f"case \"$f\" in {cases} *) ;; esac; "
+        "data=$( { "
+        f"if [ -z \"$old\" ]; then head -c \"$size\" \"$f\" | {new_file}; else "
+        "if [ \"$ino\" != \"$old\" ]; then "
+        "rot=$(find \"$(dirname \"$f\")\" -maxdepth 1 -inum \"$old\" 2>/dev/null | head -n 1); "
+        "[ -n \"$rot\" ] && tail -c +$((off + 1)) \"$rot\"; off=0; "
+        "elif [ \"$size\" -lt \"$off\" ]; then off=0; fi; "
+        "tail -c +$((off + 1)) \"$f\" | head -c $((size - off)); fi; "
+        f"}} | {grep} ); "
+        "[ -n \"$data\" ] && printf '==> %s <==\\n%s\\n' \"$f\" \"$data\"; "
+        "out=\"$out$m $ino $size $f\n\"; "
+        "done; printf '%b' \"$out\""
+    )
+
+def parse_file_follow_output(output: str, marker: str):
+    lines = []
+    cursors = {}
+    for line in output.splitlines():
+        if line.startswith(f"{marker} "):
+            inode, size, path = line[len(marker) + 1:].split(' ', 2)
+            cursors[path] = (int(inode), int(size))
+        else:
+            lines.append(line)
+    return '\n'.join(lines).strip(), cursors
+
+def parse_journal_follow_output(output: str, cursor: Optional[str]):
+    lines = []
+    for line in output.splitlines():
+        if line.startswith('-- cursor: '):
+            cursor = line[len('-- cursor: '):].strip()
+        elif line.strip() != '-- No entries --':
+            lines.append(line)
+    return '\n'.join(lines).strip(), cursor
+
+async def follow_log(user_id: int, server: str, source: str) -> str:
+    title, patterns = LOG_FOLLOW_SOURCES[source]
+    filters = log_filters.get(user_id, {})
+    lines = LOG_EXPORT_CONFIG.get('lines', 100)
+    key = (user_id, server, source)
+    cursor = log_cursors.get(key)
+
+    if patterns is None:
+        command = build_journal_follow_command(cursor, filters, lines)
+    else:
+        marker = f"@@log-cursor-{secrets.token_hex(8)}@@"
+        command = build_file_follow_command(patterns, cursor, filters, lines, marker)
+
+    remote = RemoteCommand(server, command, ssh_executor.timeout, ssh_executor.output_limit)
+    output = await ssh_executor.execute(remote)
+    if remote.exit_status is None:
+        raise RuntimeError(output.lstrip('❌ '))
+
+    stdout = remote.stdout.text()
+    if patterns is None:
+        text, log_cursors[key] = parse_journal_follow_output(stdout, cursor)
+    else:
+        text, log_cursors[key] = parse_file_follow_output(stdout, marker)
+    if remote.stdout.truncated:
+        text = f"... (новых записей больше, показан конец)\n{text}"
+    return text
+
+async def send_log_update(message: Message, title: str, text: str, reply_markup: InlineKeyboardMarkup) -> None:
+    if not text:
+        await message.edit_text(f"{title}: новых записей нет", reply_markup=reply_markup)
+    elif len(text) <= MESSAGE_OUTPUT_LIMIT:
+        await message.edit_text(f"{title}, новые записи:\n```\n{text}\n```",
+                                reply_markup=reply_markup, parse_mode='Markdown')
+    else:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         await message.answer_document(
-            document=FSInputFile(temp_file.name, filename=filename),
-            caption=f"📋 {log_type} лог от {timestamp}"
+            document=BufferedInputFile(gzip.compress(text.encode()), filename=f"new_{timestamp}.log.gz"),
+            caption=f"📋 {title}, новые записи от {timestamp}"
         )
-        
-        os.unlink(temp_file.name)
+        await message.edit_text(f"{title}: новые записи отправлены файлом ({format_bytes(len(text))})",
+                                reply_markup=reply_markup)
+
+@dataclass
+class RollingTarget:
+    server: str
+    kind: str
+    name: str
+    state: str = 'pending'
+    detail: str = ''
+
+ROLLING_STATE_EMOJI = {'pending': '⬜', 'running': '⏳', 'ok': '✅', 'failed': '❌', 'skipped': '⏭'}
+
+def build_rolling_command(kind: str, name: str, health_timeout: int) -> str:
+    # Перезапуск и ожидание готовности в одном вызове, без отдельных запросов статуса
+    quoted = shlex.quote(name)
+    if kind == 'container':
+        restart = f"docker restart {quoted} >/dev/null"
+        probe = f"docker inspect -f '{{{{if .State.Health}}}}{{{{.State.Health.Status}}}}{{{{else}}}}{{{{.State.Status}}}}{{{{end}}}}' {quoted}"
+        ready, failed = 'healthy|running', 'unhealthy|exited|dead'
+    else:
+        restart = f"sudo systemctl restart {quoted}"
+        probe = f"systemctl is-active {quoted}"
+        ready, failed = 'active', 'failed|inactive'
+    return (f"{restart} || exit 1; s=; for i in $(seq {int(health_timeout)}); do s=$({probe}); "
+            f"case \"$s\" in {ready}) echo \"$s\"; exit 0;; {failed}) echo \"$s\"; exit 1;; esac; "
+            f"sleep 1; done; echo \"$s\"; exit 1")
+
+class RollingRestart:
+    def __init__(self, message: Message, title: str, targets, batch_size: int, parallelism: int,
+                 max_failures: int, health_timeout: int):
+        self.message = message
+        self.title = title
+        self.targets = targets
+        self.batch_size = max(1, batch_size)
+        self.parallelism = max(1, parallelism)
+        self.max_failures = max(1, max_failures)
+        self.health_timeout = health_timeout
+        self.failures = 0
+
+    def render(self) -> str:
+        done = sum(target.state in ('ok', 'failed') for target in self.targets)
+        lines = [f"{ROLLING_STATE_EMOJI[target.state]} {target.server}: {target.name}"
+                 f"{f' - {target.detail}' if target.detail else ''}" for target in self.targets]
+        return (f"{self.title}\nГотово {done}/{len(self.targets)}, ошибок {self.failures} "
+                f"(партия {self.batch_size}, параллельно {self.parallelism})\n\n" + tail_text('\n'.join(lines)))
+
+    async def restart(self, target: RollingTarget, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            target.state = 'running'
+            remote = RemoteCommand(target.server, build_rolling_command(target.kind, target.name, self.health_timeout),
+                                   self.health_timeout + 60, 64 * 1024)
+            output = await ssh_executor.execute(remote)
+            target.state = 'ok' if remote.exit_status == 0 else 'failed'
+            lines = output.strip().splitlines()
+            target.detail = lines[-1][:100] if lines else ''
+            if target.state == 'failed':
+                self.failures += 1
+            command_cache.invalidate(target.server, target.name)
+            if target.kind == 'container':
+                container_inventories[target.server].invalidate()
+
+    async def push_updates(self) -> None:
+        shown = None
+        while True:
+            text = self.render()
+            if text != shown:
+                try:
+                    await self.message.edit_text(text + "\n\n⏳ Выполняется...")
+                    shown = text
+                except TelegramBadRequest as e:
+                    logger.warning(f"Не удалось обновить прогресс перезапуска: {e}")
+            await asyncio.sleep(STREAM_EDIT_INTERVAL)
+
+    async def run(self) -> str:
+        semaphore = asyncio.Semaphore(self.parallelism)
+        updater = asyncio.create_task(self.push_updates())
+        try:
+            for start in range(0, len(self.targets), self.batch_size):
+                if self.failures >= self.max_failures:
+                    for target in self.targets[start:]:
+                        target.state = 'skipped'
+                    break
+                batch = self.targets[start:start + self.batch_size]
+                await asyncio.gather(*(self.restart(target, semaphore) for target in batch))
+        finally:
+            updater.cancel()
+        if self.failures >= self.max_failures and any(target.state == 'skipped' for target in self.targets):
+            return self.render() + f"\n\n🛑 Остановлено: достигнут порог ошибок ({self.max_failures})"
+        return self.render() + ("\n\n✅ Завершено" if not self.failures else "\n\n⚠️ Завершено с ошибками")
+
+async def run_rolling_restart(message: Message, title: str, targets) -> str:
+    rolling = RollingRestart(
+        message, title, targets,
+        batch_size=ROLLING_CONFIG.get('batch_size', 1),
+        parallelism=ROLLING_CONFIG.get('parallelism', ROLLING_CONFIG.get('batch_size', 1)),
+        max_failures=ROLLING_CONFIG.get('max_failures', 1),
+        health_timeout=ROLLING_CONFIG.get('health_timeout', 60)
+    )
+    return await rolling.run()
+
+def format_rolling_plan(title: str, targets) -> str:
+    batch_size = ROLLING_CONFIG.get('batch_size', 1)
+    lines = [f"{ROLLING_STATE_EMOJI['pending']} {target.server}: {target.name}" for target in targets]
+    return (f"{title}\n\n" + tail_text('\n'.join(lines)) +
+            f"\n\nОбъектов: {len(targets)}, партия {batch_size}, "
+            f"параллельно {ROLLING_CONFIG.get('parallelism', batch_size)}, "
+            f"порог ошибок {ROLLING_CONFIG.get('max_failures', 1)}, "
+            f"ожидание готовности {ROLLING_CONFIG.get('health_timeout', 60)} с\n\n"
+            "⚠️ Запустить перезапуск?")
+
+def get_rolling_confirm_keyboard(callback_data: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Да, перезапустить", callback_data=callback_data)],
+        [InlineKeyboardButton(text="❌ Нет, отмена", callback_data='main_menu')]
+    ])
+
+bulk_selections = {}
+bulk_confirmations = {}
+
+def get_bulk_keyboard(user_id: int, server: str) -> InlineKeyboardMarkup:
+    selected = bulk_selections.get(user_id, set())
+    keyboard = [[InlineKeyboardButton(text=f"{'☑️' if container.name in selected else '⬜'} {container.name}",
+                                      callback_data=f'bulk_toggle_{container.name}')]
+                for container in container_inventories[server].snapshot()]
+    keyboard.append([InlineKeyboardButton(text=f"🔄 Перезапустить выбранные ({len(selected)})",
+                                          callback_data='bulk_restart_containers')])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+# Метка не может начинаться с '-', иначе адрес будет принят ping за ключ
+HOST_PATTERN = re.compile(r'^(?:[A-Za-z0-9_][A-Za-z0-9_-]*(?:\.[A-Za-z0-9_][A-Za-z0-9_-]*)*|\[[0-9A-Fa-f:.]+\])$')
+URL_PATTERN = re.compile(r'^https?://[^\s\'"`$\\]+$')
+
+@dataclass
+class ReachTarget:
+    kind: str
+    address: str
+    host: str = ''
+    port: int = 0
+    samples: list = field(default_factory=list)
+    lost: int = 0
+    status: str = ''
+    done: bool = False
+
+def parse_reach_target(text: str) -> ReachTarget:
+    if text.startswith(('http://', 'https://')):
+        if not URL_PATTERN.match(text):
+            raise ValueError(text)
+        return ReachTarget('http', text)
+    address = text[len('tcp://'):] if text.startswith('tcp://') else text
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit() and HOST_PATTERN.match(host) and 0 < int(port) < 65536:
+        return ReachTarget('tcp', address, host.strip('[]'), int(port))
+    if HOST_PATTERN.match(address):
+        return ReachTarget('icmp', address, address.strip('[]'))
+    raise ValueError(text)
+
+def load_reach_groups() -> dict:
+    groups = dict(REACHABILITY_CONFIG.get('groups', {}))
+    try:
+        with open(REACHABILITY_CONFIG.get('groups_file', 'probe_groups.json'), 'r') as f:
+            groups.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    return groups
+
+def save_reach_group(name: str, targets) -> None:
+    path = REACHABILITY_CONFIG.get('groups_file', 'probe_groups.json')
+    try:
+        with open(path, 'r') as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        saved = {}
+    if targets:
+        saved[name] = list(targets)
+    else:
+        saved.pop(name, None)
+    with open(path, 'w') as f:
+        json.dump(saved, f, indent=4, ensure_ascii=False)
+
+def expand_reach_targets(words) -> list:
+    groups = load_reach_groups()
+    targets = []
+    for word in words:
+        if word.startswith('@'):
+            if word[1:] not in groups:
+                raise ValueError(word)
+            targets.extend(parse_reach_target(item) for item in groups[word[1:]])
+        else:
+            targets.append(parse_reach_target(word))
+    return targets[:REACHABILITY_CONFIG.get('max_targets', 50)]
+
+def build_reach_script(targets, count: int, timeout: float) -> str:
+    # Все проверки запускаются на сервере параллельно, каждая строка результата помечена номером цели
+    wait = max(1, math.ceil(timeout))
+    jobs = []
+    for i, target in enumerate(targets):
+        if target.kind == 'icmp':
+            job = (f"ping -n -c {count} -i 0.2 -W {wait} -- {target.host} 2>/dev/null | while read -r line; do "
+                   f"case \"$line\" in *time=*) t=${{line##*time=}}; echo \"{i} R ${{t%% *}}\";; esac; done")
+        elif target.kind == 'tcp':
+            job = (f"for n in $(seq {count}); do s=$(date +%s%N); "
+                   f"if timeout {timeout:g} bash -c '</dev/tcp/{target.host}/{target.port}' 2>/dev/null; "
+                   f"then echo \"{i} N $(( $(date +%s%N) - s ))\"; else echo \"{i} L\"; fi; done")
+        else:
+            job = (f"for n in $(seq {count}); do "
+                   f"if r=$(curl -s -o /dev/null -I -m {timeout:g} -w '%{{http_code}} %{{time_total}}' "
+                   f"{shlex.quote(target.address)}); then echo \"{i} H $r\"; else echo \"{i} L\"; fi; done")
+        jobs.append(f"( {job}; echo \"{i} D\" ) &")
+    script = ' '.join(jobs) + ' wait'
+    return f"bash -c {shlex.quote(script)}"
+
+class ReachCommand(RemoteCommand):
+    def __init__(self, server: str, targets, count: int, timeout: float):
+        super().__init__(server, build_reach_script(targets, count, timeout), count * (timeout + 1) + 15, 64 * 1024)
+        self.targets = targets
+        self.count = count
+        self.pending = b''
+
+    def handle_stdout(self, data: bytes) -> None:
+        self.pending += data
+        *lines, self.pending = self.pending.split(b'\n')
+        for line in lines:
+            self.apply(line.decode('utf-8', errors='replace').split())
+
+    def apply(self, fields) -> None:
+        if len(fields) < 2 or not fields[0].isdigit() or int(fields[0]) >= len(self.targets):
+            return
+        target = self.targets[int(fields[0])]
+        kind, values = fields[1], fields[2:]
+        try:
+            if kind == 'R':
+                target.samples.append(float(values[0]))
+            elif kind == 'N':
+                target.samples.append(int(values[0]) / 1e6)
+            elif kind == 'H':
+                target.status = values[0]
+                target.samples.append(float(values[1]) * 1000)
+            elif kind == 'L':
+                target.lost += 1
+            elif kind == 'D':
+                if target.kind == 'icmp':
+                    target.lost = max(0, self.count - len(target.samples))
+                target.done = True
+        except (IndexError, ValueError):
+            pass
+
+def format_reach_row(target: ReachTarget, count: int):
+    if not target.done and not target.samples and not target.lost:
+        return (target.address, target.kind, '⏳', '-', '-', '-', '-', '')
+    samples = target.samples
+    attempts = len(samples) + target.lost if not target.done or target.kind != 'icmp' else count
+    loss = f"{target.lost * 100 // max(attempts, 1)}%" if target.done else f"{target.lost}/{attempts}"
+    if not samples:
+        return (target.address, target.kind, loss, '-', '-', '-', '-', target.status)
+    jitter = sum(abs(b - a) for a, b in zip(samples, samples[1:])) / (len(samples) - 1) if len(samples) > 1 else 0.0
+    return (target.address, target.kind, loss, f"{min(samples):.1f}", f"{sum(samples) / len(samples):.1f}",
+            f"{max(samples):.1f}", f"{jitter:.1f}", target.status)
+
+def format_reach_results(targets, count: int) -> str:
+    rows = [format_reach_row(target, count) for target in targets]
+    return format_table(('цель', 'тип', 'потери', 'min', 'avg', 'max', 'jitter', ''), rows)
+
+async def run_reachability(message: Message, server: str, targets) -> str:
+    count = REACHABILITY_CONFIG.get('count', 3)
+    remote = ReachCommand(server, targets, count, REACHABILITY_CONFIG.get('timeout', 2))
+    title = f"🏓 Проверка доступности с {server} ({len(targets)} целей, мс):"
+
+    async def push_updates():
+        shown = None
+        while True:
+            await asyncio.sleep(STREAM_EDIT_INTERVAL)
+            text = format_reach_results(targets, count)
+            if text == shown:
+                continue
+            try:
+                await message.edit_text(f"{title}\n```\n{tail_text(text)}\n```\n⏳ Выполняется...",
+                                        parse_mode='Markdown')
+                shown = text
+            except TelegramBadRequest as e:
+                logger.warning(f"Не удалось обновить результаты проверки: {e}")
+
+    updater = asyncio.create_task(push_updates())
+    try:
+        output = await ssh_executor.execute(remote)
+    finally:
+        updater.cancel()
+    for target in targets:
+        if not target.done:
+            target.lost = max(target.lost, count - len(target.samples))
+            target.done = True
+    result = f"{title}\n```\n{tail_text(format_reach_results(targets, count))}\n```"
+    if remote.exit_status is None:
+        result += f"\n{output}"
+    return result
+
+REACH_USAGE = (
+    "Цели через пробел:\n"
+    "• 8.8.8.8, ya.ru - ICMP пинг с сервера\n"
+    "• db.local:5432 - TCP подключение\n"
+    "• https://example.com - HTTP HEAD\n"
+    "• @web - сохраненная группа целей"
+)
 
 class PingState(StatesGroup):
     waiting_for_address = State()
@@ -195,18 +2596,16 @@ async def handle_menu(message: Message, state: FSMContext) -> None:
         return
     elif message.text == "🏓 Пинг":
         await state.set_state(PingState.waiting_for_address)
+        groups = ' '.join(f"@{name}" for name in load_reach_groups())
         await message.answer(
-            "🏓 Введите адрес для пинга:\n\n"
-            "Примеры адресов:\n"
-            "• 8.8.8.8\n"
-            "• google.com\n"
-            "• ya.ru",
+            f"🏓 Введите адреса для проверки:\n\n{REACH_USAGE}" + (f"\n\nГруппы: {groups}" if groups else ''),
             reply_markup=keyboard
         )
         return
     elif message.text == "🖥 Статус":
         await state.clear()
         keyboard = [
+            get_server_button(message.from_user.id),
             [InlineKeyboardButton(text="💾 Проверить диск", callback_data='check_disk')],
             [InlineKeyboardButton(text="🧠 Проверить память", callback_data='check_memory')],
             [InlineKeyboardButton(text="📊 Проверить нагрузку", callback_data='check_load')]
@@ -217,6 +2616,7 @@ async def handle_menu(message: Message, state: FSMContext) -> None:
     elif message.text == "⚙️ Сервисы":
         await state.clear()
         keyboard = [
+            get_server_button(message.from_user.id),
             [InlineKeyboardButton(text="🌐 Nginx", callback_data='service_nginx')],
             [InlineKeyboardButton(text="🗄 PostgreSQL", callback_data='service_postgresql')],
             [InlineKeyboardButton(text="🐳 Docker", callback_data='service_docker')]
@@ -227,23 +2627,37 @@ async def handle_menu(message: Message, state: FSMContext) -> None:
     elif message.text == "📋 Логи":
         await state.clear()
         keyboard = [
+            get_server_button(message.from_user.id),
             [InlineKeyboardButton(text="📊 Системные логи", callback_data='logs_system')],
             [InlineKeyboardButton(text="🐳 Docker логи", callback_data='logs_docker')],
             [InlineKeyboardButton(text="🌐 Nginx логи", callback_data='logs_nginx')],
-            [InlineKeyboardButton(text="🗄 PostgreSQL логи", callback_data='logs_postgres')]
+            [InlineKeyboardButton(text="🗄 PostgreSQL логи", callback_data='logs_postgres')],
+            *([InlineKeyboardButton(text=f"📦 Журнал за {title}", callback_data=f'export_journal_{period}')]
+              for period, (title, since) in JOURNAL_EXPORT_PERIODS.items()),
+            [InlineKeyboardButton(text=f"🆕 {title}", callback_data=f'follow_{source}')
+             for source, (title, patterns) in LOG_FOLLOW_SOURCES.items()]
         ]
         inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-        await message.answer('📋 Выберите тип логов для просмотра:', reply_markup=inline_markup)
+        await message.answer('📋 Выберите тип логов для просмотра:\n\n'
+                             '🆕 - только новые записи с прошлого просмотра, фильтр задается командой /logfilter',
+                             reply_markup=inline_markup)
         return
     elif message.text == "🔄 Перезагрузка":
         await state.clear()
+        if is_all_servers(message.from_user.id):
+            inline_markup = InlineKeyboardMarkup(inline_keyboard=[get_server_button(message.from_user.id)])
+            await message.answer('⚠️ Перезагрузка выполняется только на одном сервере. Выберите сервер:',
+                                 reply_markup=inline_markup)
+            return
+        server = get_server(message.from_user.id)
+        # Сервер зашит в кнопку: смена выбранного сервера после вопроса не меняет цель перезагрузки
         keyboard = [
-            [InlineKeyboardButton(text="✅ Да, перезагрузить", callback_data='confirm_reboot')],
+            [InlineKeyboardButton(text=f"✅ Да, перезагрузить {server}", callback_data=f'confirm_reboot_{server}')],
             [InlineKeyboardButton(text="❌ Нет, отмена", callback_data='main_menu')]
         ]
         inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-        await message.answer('⚠️ Вы уверены, что хотите перезагрузить сервер?', 
-                           reply_markup=inline_markup)
+        await message.answer(f'⚠️ Вы уверены, что хотите перезагрузить сервер {server}?',
+                             reply_markup=inline_markup)
         return
 
     await state.clear()
@@ -260,6 +2674,7 @@ async def handle_callback(callback: CallbackQuery) -> None:
 
     if callback.data == 'status':
         keyboard = [
+            get_server_button(callback.from_user.id),
             [InlineKeyboardButton(text="💾 Проверить диск", callback_data='check_disk')],
             [InlineKeyboardButton(text="🧠 Проверить память", callback_data='check_memory')],
             [InlineKeyboardButton(text="📊 Проверить нагрузку", callback_data='check_load')]
@@ -269,6 +2684,7 @@ async def handle_callback(callback: CallbackQuery) -> None:
 
     elif callback.data == 'services':
         keyboard = [
+            get_server_button(callback.from_user.id),
             [InlineKeyboardButton(text="🌐 Nginx", callback_data='service_nginx')],
             [InlineKeyboardButton(text="🗄 PostgreSQL", callback_data='service_postgresql')],
             [InlineKeyboardButton(text="🐳 Docker", callback_data='service_docker')]
@@ -285,64 +2701,234 @@ async def handle_callback(callback: CallbackQuery) -> None:
         inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
         await callback.message.edit_text('🤖 Главное меню:', reply_markup=inline_markup)
 
+    elif callback.data == 'select_server':
+        keyboard = [[InlineKeyboardButton(text=f"🖥 {server}", callback_data=f'server_{server}')]
+                    for server in SSH_CONFIG]
+        keyboard.append([InlineKeyboardButton(text="🌐 Все серверы", callback_data=f'server_{ALL_SERVERS}')])
+        inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
+        await callback.message.edit_text('🖥 Выберите сервер:', reply_markup=inline_markup)
+
+    elif callback.data.startswith('server_'):
+        server = callback.data.replace('server_', '', 1)
+        if server != ALL_SERVERS and server not in SSH_CONFIG:
+            await callback.message.edit_text(f'❌ Неизвестный сервер: {server}')
+            return
+        selected_servers[callback.from_user.id] = server
+        title = "все серверы" if server == ALL_SERVERS else server
+        await callback.message.edit_text(f'✅ Выбран сервер: {title}\n\nВыберите действие в меню 👇')
+
     elif callback.data.startswith('service_'):
         service = callback.data.split('_')[1]
         if service == 'docker':
-            result = execute_ssh_command('server1', 'docker ps -a --format "{{.Names}}|{{.Status}}"')
-            containers = result.strip().split('\n')
+            server = await require_single_server(callback, 'Управление контейнерами')
+            if server is None:
+                return
+            inventory = container_inventories[server]
+            try:
+                await inventory.ensure_ready()
+            except Exception as e:
+                await callback.message.edit_text(f"❌ Ошибка: {str(e)}")
+                return
             
             keyboard = []
-            for container in containers:
-                if container:
-                    name, status = container.split('|')
-                    emoji = get_container_status_emoji(status)
-                    keyboard.append([
-                        InlineKeyboardButton(
-                            text=f"{emoji} {name}",
-                            callback_data=f'docker_info_{name}'
-                        )
-                    ])
+            for container in inventory.snapshot():
+                emoji = get_container_status_emoji(container)
+                keyboard.append([
+                    InlineKeyboardButton(
+                        text=f"{emoji} {container.name}",
+                        callback_data=f'docker_info_{container.name}'
+                    )
+                ])
+            keyboard.append([InlineKeyboardButton(text="☑️ Выбрать несколько", callback_data='bulk_containers')])
             inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-            await callback.message.edit_text('🐳 Все контейнеры:', reply_markup=inline_markup)
+            await callback.message.edit_text(f'🐳 Все контейнеры на {server}:{inventory.staleness()}',
+                                             reply_markup=inline_markup)
         else:
-            keyboard = [
-                [InlineKeyboardButton(text="📊 Статус", callback_data=f'status_{service}')],
-                [InlineKeyboardButton(text="🔄 Перезапустить", callback_data=f'restart_{service}')]
-            ]
+            keyboard = [[InlineKeyboardButton(text="📊 Статус", callback_data=f'status_{service}')]]
+            if is_all_servers(callback.from_user.id):
+                title = f'⚙️ Управление {service} на всех серверах:'
+            else:
+                title = f'⚙️ Управление {service} на {get_server(callback.from_user.id)}:'
+                keyboard.append([InlineKeyboardButton(text="🔄 Перезапустить", callback_data=f'restart_{service}')])
+            keyboard.append([InlineKeyboardButton(text="🔁 Перезапустить на всех серверах по очереди",
+                                                  callback_data=f'rolling_unit_{service}')])
             inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-            await callback.message.edit_text(f'⚙️ Управление {service}:', reply_markup=inline_markup)
+            await callback.message.edit_text(title, reply_markup=inline_markup)
 
     elif callback.data.startswith('status_'):
         service = callback.data.split('_')[1]
-        result = execute_ssh_command('server1', f'systemctl status {service}')
+        servers = get_target_servers(callback.from_user.id)
+        if len(servers) > 1:
+            if service in MONITORED_UNITS:
+                snapshots = await get_snapshots(servers)
+                summary = format_snapshot_summary(snapshots, ['Состояние'],
+                                                  lambda snapshot: format_unit_row(snapshot, service))
+            else:
+                results = await run_on_servers(servers, f'systemctl is-active {service}', cached=True)
+                summary = format_fanout_summary(results, ['Состояние'], parse_service_row)
+            await callback.message.edit_text(f'📊 Статус {service} на всех серверах:\n```\n{summary}\n```',
+                                             parse_mode='Markdown')
+            return
+        result = await run_ssh_command(servers[0], f'systemctl status {service}', cached=True)
         keyboard = [
             [InlineKeyboardButton(text="🔄 Перезапустить", callback_data=f'restart_{service}')]
         ]
-        inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-        await callback.message.edit_text(f'📊 Статус {service}:\n```\n{result}\n```', 
-                              reply_markup=inline_markup,
-                              parse_mode='Markdown')
+        await show_output(callback.message, f'📊 Статус {service}:', result, f'{service}_status.txt', keyboard)
+
+    elif callback.data.startswith(('start_container_', 'stop_container_', 'restart_container_')):
+        action, container_name = callback.data.split('_container_', 1)
+        server = await require_single_server(callback, 'Действие с контейнером')
+        if server is None:
+            return
+        await show_loading(callback.message, f"🐳 {server}, {container_name}: {action}...")
+        result = await run_ssh_command(server, f'docker {action} {shlex.quote(container_name)}')
+        command_cache.invalidate(server, 'docker')
+        container_inventories[server].invalidate()
+        keyboard = [[InlineKeyboardButton(text="🐳 К контейнеру", callback_data=f'docker_info_{container_name}')]]
+        await show_output(callback.message, f'🐳 Результат {action} {container_name} на {server}:', result,
+                          f'{container_name}_{action}.txt', keyboard)
+
+    elif callback.data.startswith('confirm_reboot_'):
+        server = callback.data.replace('confirm_reboot_', '', 1)
+        if server not in SSH_CONFIG:
+            await callback.message.edit_text(f'❌ Неизвестный сервер: {server}')
+            return
+        command_cache.invalidate(server)
+        await show_loading(callback.message, f"🔄 Перезагрузка {server}...")
+        # Соединение рвется вместе с перезагрузкой, поэтому результат команды не ждем дольше нескольких секунд
+        await run_ssh_command(server, 'sudo systemctl reboot', timeout=10)
+        await asyncio.to_thread(ssh_pool.discard, server)
+        await callback.message.edit_text(f'🔄 Сервер {server} отправлен на перезагрузку.')
 
     elif callback.data.startswith('restart_'):
         service = callback.data.split('_')[1]
-        result = execute_ssh_command('server1', f'sudo systemctl restart {service}')
-        status = execute_ssh_command('server1', f'systemctl status {service}')
-        keyboard = []
-        inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-        await callback.message.edit_text(f'🔄 Результат перезапуска {service}:\n```\n{status}\n```', 
-                              reply_markup=inline_markup,
-                              parse_mode='Markdown')
+        rolling = [[InlineKeyboardButton(text="🔁 Перезапустить на всех серверах по очереди",
+                                         callback_data=f'rolling_unit_{service}')]]
+        server = await require_single_server(callback, f'Перезапуск {service}', rolling)
+        if server is None:
+            return
+        await show_loading(callback.message, f"🔄 Перезапуск {service} на {server}...")
+        command_cache.invalidate(server, service)
+        result = await stream_ssh_command(callback.message, server, f'sudo systemctl restart {service}',
+                                          f'🔄 Перезапуск {service} на {server}:')
+        command_cache.invalidate(server, service)
+        status = await run_ssh_command(server, f'systemctl status {service}')
+        await show_output(callback.message, f'🔄 Результат перезапуска {service} на {server}:', status,
+                          f'{service}_status.txt')
+
+    elif callback.data.startswith('rolling_unit_'):
+        service = callback.data.replace('rolling_unit_', '', 1)
+        targets = [RollingTarget(server, 'unit', service) for server in SSH_CONFIG]
+        await callback.message.edit_text(
+            format_rolling_plan(f"🔁 Перезапуск {service} на всех серверах", targets),
+            reply_markup=get_rolling_confirm_keyboard(f'confirm_rolling_unit_{service}'))
+
+    elif callback.data.startswith('confirm_rolling_unit_'):
+        service = callback.data.replace('confirm_rolling_unit_', '', 1)
+        targets = [RollingTarget(server, 'unit', service) for server in SSH_CONFIG]
+        result = await run_rolling_restart(callback.message, f"🔁 Перезапуск {service} на всех серверах", targets)
+        await callback.message.edit_text(result)
+
+    elif callback.data == 'bulk_containers':
+        server = await require_single_server(callback, 'Выбор контейнеров')
+        if server is None:
+            return
+        try:
+            await container_inventories[server].ensure_ready()
+        except Exception as e:
+            await callback.message.edit_text(f"❌ Ошибка: {str(e)}")
+            return
+        bulk_selections[callback.from_user.id] = set()
+        await callback.message.edit_text(f'☑️ Выберите контейнеры на {server}:',
+                                         reply_markup=get_bulk_keyboard(callback.from_user.id, server))
+
+    elif callback.data.startswith('bulk_toggle_'):
+        name = callback.data.replace('bulk_toggle_', '', 1)
+        server = await require_single_server(callback, 'Выбор контейнеров')
+        if server is None:
+            return
+        selected = bulk_selections.setdefault(callback.from_user.id, set())
+        selected.symmetric_difference_update({name})
+        await callback.message.edit_reply_markup(reply_markup=get_bulk_keyboard(callback.from_user.id, server))
+
+    elif callback.data == 'bulk_restart_containers':
+        server = await require_single_server(callback, 'Перезапуск контейнеров')
+        if server is None:
+            return
+        selected = bulk_selections.pop(callback.from_user.id, set())
+        if not selected:
+            await callback.message.edit_text('❌ Контейнеры не выбраны')
+            return
+        names = [container.name for container in container_inventories[server].snapshot() if container.name in selected]
+        targets = [RollingTarget(server, 'container', name) for name in names]
+        # Подтверждается именно показанный список, даже если выбранный сервер потом сменится
+        bulk_confirmations[callback.from_user.id] = targets
+        await callback.message.edit_text(format_rolling_plan(f"🔁 Перезапуск контейнеров на {server}", targets),
+                                         reply_markup=get_rolling_confirm_keyboard('confirm_bulk_restart'))
+
+    elif callback.data == 'confirm_bulk_restart':
+        targets = bulk_confirmations.pop(callback.from_user.id, None)
+        if not targets:
+            await callback.message.edit_text('❌ Контейнеры не выбраны')
+            return
+        result = await run_rolling_restart(callback.message, f"🔁 Перезапуск контейнеров на {targets[0].server}",
+                                           targets)
+        await callback.message.edit_text(result)
+
+    elif callback.data.startswith('docker_inspect_'):
+        container_name = callback.data.replace('docker_inspect_', '', 1)
+        server = await require_single_server(callback, 'docker inspect')
+        if server is None:
+            return
+        result = await run_ssh_command(server, f'docker inspect {shlex.quote(container_name)}', cached=True)
+        keyboard = [[InlineKeyboardButton(text="🐳 К контейнеру", callback_data=f'docker_info_{container_name}')]]
+        await show_output(callback.message, f'📄 docker inspect {container_name} на {server}:', result,
+                          f'{container_name}_inspect.json', keyboard)
+
+    elif callback.data.startswith('page_'):
+        token, _, page = callback.data.replace('page_', '', 1).partition('_')
+        entry = output_pages.get(token)
+        if entry is None:
+            await callback.message.edit_text('⌛ Вывод больше не хранится, выполните команду снова')
+            return
+        text, markup = render_output_page(token, entry, int(page))
+        try:
+            await callback.message.edit_text(text, reply_markup=markup, parse_mode='Markdown')
+        except TelegramBadRequest as e:
+            # Повторное нажатие на ту же кнопку: страница уже показана
+            if 'message is not modified' not in str(e):
+                raise
+
+    elif callback.data.startswith('pagefile_'):
+        entry = output_pages.get(callback.data.replace('pagefile_', '', 1))
+        if entry is None:
+            await callback.message.answer('⌛ Вывод больше не хранится, выполните команду снова')
+            return
+        title, text, filename, extra_rows = entry
+        await callback.message.answer_document(BufferedInputFile(text.encode('utf-8'), filename=filename),
+                                               caption=title)
 
     elif callback.data.startswith('docker_info_'):
         container_name = callback.data.replace('docker_info_', '')
-        info = execute_ssh_command('server1', f'docker inspect {container_name}')
-        status = execute_ssh_command('server1', f'docker ps -a | grep {container_name}')
+        server = await require_single_server(callback, 'Управление контейнерами')
+        if server is None:
+            return
+        inventory = container_inventories[server]
+        try:
+            await inventory.ensure_ready()
+        except Exception as e:
+            await callback.message.edit_text(f"❌ Ошибка: {str(e)}")
+            return
+        container = inventory.find(container_name)
+        if container is None:
+            await callback.message.edit_text(f'❌ Контейнер {container_name} не найден на {server}')
+            return
         
-        is_running = 'Up' in status
-        emoji = get_container_status_emoji(status)
-        formatted_status = format_container_status(status)
+        is_running = container.status == 'running'
+        emoji = get_container_status_emoji(container)
+        formatted_status = format_container_status(container)
         
-        keyboard = []
+        keyboard = [[InlineKeyboardButton(text="📄 docker inspect", callback_data=f'docker_inspect_{container_name}')]]
         if is_running:
             keyboard.extend([
                 [InlineKeyboardButton(text="🛑 Остановить", callback_data=f'stop_container_{container_name}')],
@@ -355,93 +2941,110 @@ async def handle_callback(callback: CallbackQuery) -> None:
         
         await callback.message.edit_text(
             f'🐳 Информация о контейнере:\n\n'
+            f'Сервер: {server}\n'
             f'Имя: {container_name}\n'
             f'Статус: {emoji} {formatted_status}\n\n'
-            f'Техническая информация:\n```\n{status}\n```',
+            f'Техническая информация:\n```\n'
+            f'ID: {container.id[:12]}\n'
+            f'Образ: {container.image}\n'
+            f'Перезапусков: {container.restart_count}\n```'
+            f'{inventory.staleness()}',
             reply_markup=inline_markup,
             parse_mode='Markdown'
         )
 
-    elif callback.data == 'logs_system':
-        await show_loading(callback.message, "📊 Получение системных логов...")
-        journalctl = execute_ssh_command('server1', 'journalctl -n 100 --no-pager')
-        await save_and_send_log(callback.message, journalctl, "Системные")
+    elif callback.data in LOG_SOURCES:
+        loading_text, command, log_type = LOG_SOURCES[callback.data]
+        await show_loading(callback.message, loading_text)
+        servers = get_target_servers(callback.from_user.id)
+        result = await export_log(callback.message, servers,
+                                  command.format(lines=LOG_EXPORT_CONFIG.get('lines', 100)), log_type)
         
         keyboard = []
         inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
         await callback.message.edit_text(
-            '✅ Системные логи сохранены и отправлены.',
+            result,
             reply_markup=inline_markup
         )
 
-    elif callback.data == 'logs_docker':
-        await show_loading(callback.message, "🐳 Получение логов Docker...")
-        containers = execute_ssh_command('server1', 'docker ps -a --format "{{.Names}}"')
-        containers = containers.strip().split('\n')
-        
-        all_logs = []
-        for container in containers:
-            if container:
-                container_logs = execute_ssh_command('server1', f'docker logs --tail 50 {container}')
-                all_logs.append(f"\n=== Логи контейнера {container} ===\n{container_logs}")
-        
-        docker_logs = "\n".join(all_logs)
-        await save_and_send_log(callback.message, docker_logs, "Docker")
-        
-        keyboard = []
+    elif callback.data.startswith('export_journal_'):
+        title, since = JOURNAL_EXPORT_PERIODS[callback.data.replace('export_journal_', '', 1)]
+        await show_loading(callback.message, f"📦 Выгрузка системного журнала за {title}...")
+        servers = get_target_servers(callback.from_user.id)
+        result = await export_log(callback.message, servers,
+                                  f'journalctl --since {shlex.quote(since)} --no-pager', "Системные")
+        await callback.message.edit_text(result)
+
+    elif callback.data.startswith('follow_'):
+        source = callback.data.replace('follow_', '', 1)
+        title, patterns = LOG_FOLLOW_SOURCES[source]
+        await show_loading(callback.message, f"{title}: получение новых записей...")
+        servers = get_target_servers(callback.from_user.id)
+        results = await asyncio.gather(*(follow_log(callback.from_user.id, server, source) for server in servers),
+                                       return_exceptions=True)
+        parts = []
+        for server, result in zip(servers, results):
+            if isinstance(result, Exception):
+                result = f"❌ Ошибка: {result}"
+            if len(servers) > 1 and result:
+                result = f"=== Сервер {server} ===\n{result}"
+            if result:
+                parts.append(result)
+        keyboard = [[InlineKeyboardButton(text="🔄 Проверить снова", callback_data=callback.data)]]
         inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-        await callback.message.edit_text(
-            '✅ Логи Docker сохранены и отправлены.',
-            reply_markup=inline_markup
-        )
+        await send_log_update(callback.message, title, '\n\n'.join(parts), inline_markup)
 
-    elif callback.data == 'logs_nginx':
-        await show_loading(callback.message, "🌐 Получение логов Nginx...")
-        nginx_logs = execute_ssh_command('server1', 'tail -n 100 /var/log/nginx/access.log /var/log/nginx/error.log')
-        await save_and_send_log(callback.message, nginx_logs, "Nginx")
-        
-        keyboard = []
+    elif callback.data == 'logs_docker':
+        keyboard = [[InlineKeyboardButton(text=title, callback_data=f'docker_logs_{preset}')]
+                    for preset, (title, filters) in DOCKER_LOG_PRESETS.items()]
         inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
         await callback.message.edit_text(
-            '✅ Логи Nginx сохранены и отправлены.',
+            '🐳 Логи каких контейнеров собрать?\n\n'
+            'Произвольный фильтр: /dockerlogs name=web label=app=api status=running tail=200',
             reply_markup=inline_markup
         )
 
-    elif callback.data == 'logs_postgres':
-        await show_loading(callback.message, "🗄 Получение логов PostgreSQL...")
-        postgres_logs = execute_ssh_command('server1', 'tail -n 100 /var/log/postgresql/postgresql-*.log')
-        await save_and_send_log(callback.message, postgres_logs, "PostgreSQL")
+    elif callback.data.startswith('docker_logs_'):
+        preset = callback.data.replace('docker_logs_', '', 1)
+        title, filters = DOCKER_LOG_PRESETS.get(preset, DOCKER_LOG_PRESETS['all'])
+        await show_loading(callback.message, "🐳 Получение логов Docker...")
+        servers = get_target_servers(callback.from_user.id)
+        result = await send_docker_logs(callback.message, servers, filters, DOCKER_LOGS_CONFIG.get('tail', 50))
         
         keyboard = []
         inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
         await callback.message.edit_text(
-            '✅ Логи PostgreSQL сохранены и отправлены.',
+            result,
             reply_markup=inline_markup
         )
 
-    elif callback.data == 'check_disk':
-        result = execute_ssh_command('server1', 'df -h')
-        keyboard = []
-        inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-        await callback.message.edit_text(f'💾 Использование диска:\n```\n{result}\n```', 
-                              reply_markup=inline_markup,
-                              parse_mode='Markdown')
+    elif callback.data in STATUS_VIEWS:
+        servers = get_target_servers(callback.from_user.id)
+        title, kind, headers = STATUS_VIEWS[callback.data]
+        snapshots = await get_snapshots(servers)
+        if len(servers) > 1:
+            summary = format_snapshot_summary(snapshots, headers, lambda snapshot: format_sample_row(kind, snapshot))
+            await callback.message.edit_text(f'{title} на всех серверах:\n```\n{summary}\n```',
+                                             parse_mode='Markdown')
+            return
 
-    elif callback.data == 'check_memory':
-        result = execute_ssh_command('server1', 'free -h')
-        keyboard = []
-        inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-        await callback.message.edit_text(f'🧠 Использование памяти:\n```\n{result}\n```', 
-                              reply_markup=inline_markup,
-                              parse_mode='Markdown')
+        snapshot = snapshots[servers[0]]
+        if not isinstance(snapshot, HostSnapshot):
+            await callback.message.edit_text(f'❌ Ошибка: {snapshot}')
+            return
+        await callback.message.edit_text(f'{title}:\n```\n{format_sample_details(kind, snapshot)}\n```',
+                                         reply_markup=get_history_keyboard(kind),
+                                         parse_mode='Markdown')
 
-    elif callback.data == 'check_load':
-        result = execute_ssh_command('server1', 'top -b -n 1 | head -n 5')
-        keyboard = []
-        inline_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-        await callback.message.edit_text(f'📊 Нагрузка системы:\n```\n{result}\n```', 
-                              reply_markup=inline_markup,
-                              parse_mode='Markdown')
+    elif callback.data.startswith('history_'):
+        _, kind, window = callback.data.split('_')
+        period, seconds = HISTORY_WINDOWS[window]
+        server = get_server(callback.from_user.id)
+        await callback.message.edit_text(
+            f'📈 {server}, статистика за {period}:\n```\n{format_history(server, kind, seconds)}\n```',
+            reply_markup=get_history_keyboard(kind),
+            parse_mode='Markdown'
+        )
 
 async def handle_ping(message: Message, state: FSMContext) -> None:
     if message.from_user.id not in ADMIN_IDS:
@@ -451,15 +3054,62 @@ async def handle_ping(message: Message, state: FSMContext) -> None:
     keyboard = get_reply_keyboard()
     
     try:
-        result = execute_ssh_command('server1', f'ping -c 4 {message.text}')
-        await message.answer(f"🏓 Результат пинга {message.text}:\n```\n{result}\n```", 
-                           parse_mode='Markdown',
-                           reply_markup=keyboard)
+        await run_reach_message(message, message.text.replace(',', ' ').split())
     except Exception as e:
         await message.answer(f"❌ Ошибка при выполнении пинга: {str(e)}", reply_markup=keyboard)
     finally:
         await state.clear()
 
+async def run_reach_message(message: Message, words) -> None:
+    try:
+        targets = expand_reach_targets(words)
+    except ValueError as e:
+        await message.answer(f"❌ Некорректная цель: {e}\n\n{REACH_USAGE}")
+        return
+    if not targets:
+        await message.answer(REACH_USAGE)
+        return
+    progress = await message.answer(f"🏓 Проверка {len(targets)} целей...\n\n⏳ Загрузка...")
+    result = await run_reachability(progress, get_server(message.from_user.id), targets)
+    await progress.edit_text(result, parse_mode='Markdown')
+
+async def handle_probe(message: Message) -> None:
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer('⛔ У вас нет доступа к этому боту.')
+        return
+
+    await run_reach_message(message, message.text.replace(',', ' ').split()[1:])
+
+async def handle_probe_group(message: Message) -> None:
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer('⛔ У вас нет доступа к этому боту.')
+        return
+
+    args = message.text.replace(',', ' ').split()[1:]
+    if len(args) >= 3 and args[0] == 'save':
+        try:
+            for word in args[2:]:
+                parse_reach_target(word)
+        except ValueError as e:
+            await message.answer(f"❌ Некорректная цель: {e}\n\n{REACH_USAGE}")
+            return
+        save_reach_group(args[1], args[2:])
+        await message.answer(f"✅ Группа @{args[1]} сохранена ({len(args) - 2} целей)")
+        return
+    if len(args) == 2 and args[0] == 'delete':
+        save_reach_group(args[1], [])
+        await message.answer(f"🗑 Группа @{args[1]} удалена")
+        return
+
+    groups = load_reach_groups()
+    lines = [f"@{name}: {' '.join(targets)}" for name, targets in groups.items()]
+    await message.answer(
+        ("📋 Группы целей:\n" + '\n'.join(lines) if lines else "📋 Сохраненных групп нет") +
+        "\n\nСохранить: /probegroup save web https://example.com db.local:5432\n"
+        "Удалить: /probegroup delete web\n"
+        "Проверить: /probe @web 8.8.8.8"
+    )
+
 async def handle_text(message: Message) -> None:
     if message.from_user.id not in ADMIN_IDS:
         await message.answer('⛔ У вас нет доступа к этому боту.')
@@ -469,14 +3119,365 @@ async def handle_text(message: Message) -> None:
     reply_markup = ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
     await message.answer("Введите команду /ping и адрес:", reply_markup=reply_markup)
 
-async def main() -> None:
+async def handle_docker_logs(message: Message) -> None:
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer('⛔ У вас нет доступа к этому боту.')
+        return
+
+    try:
+        filters, tail = parse_docker_log_filters(message.text.split()[1:])
+    except ValueError as e:
+        await message.answer(
+            f"❌ Неизвестный фильтр: {e}\n\n"
+            f"Доступные фильтры: {', '.join(DOCKER_LOG_FILTERS)}, tail=N"
+        )
+        return
+
+    progress = await message.answer("🐳 Получение логов Docker...\n\n⏳ Загрузка...")
+    result = await send_docker_logs(message, get_target_servers(message.from_user.id), filters, tail)
+    await progress.edit_text(result)
+
+async def handle_rolling(message: Message) -> None:
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer('⛔ У вас нет доступа к этому боту.')
+        return
+
+    args = message.text.split()[1:]
+    if len(args) < 2 or args[0] not in ('unit', 'container'):
+        await message.answer(
+            "Использование:\n"
+            "/rolling unit nginx postgresql - перезапустить сервисы\n"
+            "/rolling container web-1 web-2 - перезапустить контейнеры\n\n"
+            "Действие выполняется на выбранном сервере или по очереди на всех серверах."
+        )
+        return
+
+    kind, names = args[0], args[1:]
+    servers = get_target_servers(message.from_user.id)
+    targets = [RollingTarget(server, kind, name) for server in servers for name in names]
+    progress = await message.answer("🔁 Подготовка перезапуска...")
+    title = f"🔁 Перезапуск: {', '.join(names)}"
+    result = await run_rolling_restart(progress, title, targets)
+    await progress.edit_text(result)
+
+async def handle_log_filter(message: Message) -> None:
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer('⛔ У вас нет доступа к этому боту.')
+        return
+
+    try:
+        args = shlex.split(message.text)[1:]
+    except ValueError as e:
+        await message.answer(f"❌ Ошибка: {str(e)}")
+        return
+
+    if args == ['reset']:
+        log_filters.pop(message.from_user.id, None)
+    elif args:
+        try:
+            log_filters[message.from_user.id] = parse_log_filters(args)
+        except ValueError as e:
+            await message.answer(
+                f"❌ Неизвестный фильтр: {e}\n\n"
+                "Пример: /logfilter unit=nginx priority=err grep='timeout|refused' since='1 hour ago'\n"
+                f"Приоритеты: {', '.join(LOG_PRIORITIES)}\n"
+                "Сбросить фильтр: /logfilter reset"
+            )
+            return
+
+    filters = log_filters.get(message.from_user.id)
+    current = '\n'.join(f"• {key} = {value}" for key, value in filters.items()) if filters else 'не задан'
+    await message.answer(
+        f"🔎 Фильтр новых записей логов:\n{current}\n\n"
+        "unit, priority, since и until применяются к системному журналу, grep - ко всем логам."
+    )
+
+async def handle_alerts(message: Message) -> None:
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer('⛔ У вас нет доступа к этому боту.')
+        return
+
+    rules = {rule['name']: rule for rule in alert_engine.rules}
+    lines = [f"🔴 {server}: {rules[name]['title']}{f' {subject}' if subject else ''}"
+             for name, server, subject in alert_engine.active() if name in rules]
+    await message.answer("🚨 Активные оповещения:\n\n" + '\n'.join(lines) if lines else "✅ Активных оповещений нет")
+
+CALLBACK_PREFIXES = ('start_container_', 'stop_container_', 'restart_container_', 'server_', 'service_',
+                     'status_', 'restart_', 'rolling_unit_', 'confirm_rolling_unit_', 'bulk_toggle_',
+                     'docker_inspect_', 'docker_info_', 'export_journal_', 'follow_', 'docker_logs_', 'history_',
+                     'pagefile_', 'page_', 'confirm_reboot_')
+CALLBACK_ACTIONS = {'status', 'services', 'main_menu', 'select_server', 'logs_docker',
+                    'bulk_containers', 'bulk_restart_containers', 'confirm_bulk_restart', 'noop'}
+BOT_COMMANDS = {'start', 'pool', 'dockerlogs', 'logfilter', 'alerts', 'stats', 'rolling', 'probe', 'probegroup'}
+
+def callback_action(data: str) -> str:
+    # Имя сервера или контейнера в метку не попадает, иначе число рядов метрик не ограничено
+    if data in CALLBACK_ACTIONS or data in LOG_SOURCES or data in STATUS_VIEWS:
+        return data
+    for prefix in CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return prefix.rstrip('_')
+    return 'other'
+
+def message_action(text: str) -> str:
+    if not text.startswith('/'):
+        return 'text'
+    command = text.split()[0][1:].split('@')[0]
+    return command if command in BOT_COMMANDS else 'other'
+
+async def instrument_handler(handler, event, data, kind: str, action: str):
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception:
+        telemetry.inc('bot_handler_errors_total', handler=kind, action=action)
+        raise
+    finally:
+        telemetry.observe('bot_handler_seconds', time.perf_counter() - started, handler=kind, action=action)
+
+async def instrument_callback(handler, event: CallbackQuery, data: dict):
+    return await instrument_handler(handler, event, data, 'callback', callback_action(event.data or ''))
+
+async def instrument_message(handler, event: Message, data: dict):
+    return await instrument_handler(handler, event, data, 'message', message_action(event.text or ''))
+
+def format_seconds(value: float) -> str:
+    return f"{value * 1000:.0f}мс" if value < 1 else f"{value:.1f}с"
+
+def handler_title(labels: dict) -> str:
+    if labels['handler'] == 'message' and labels['action'] not in ('text', 'other'):
+        return '/' + labels['action']
+    return labels['action']
+
+def format_stats() -> str:
+    handlers = sorted(telemetry.series('bot_handler_seconds'), key=lambda item: -item[1].count)[:15]
+    handler_rows = [(handler_title(labels), histogram.count,
+                     format_seconds(histogram.quantile(0.5)), format_seconds(histogram.quantile(0.95)),
+                     int(telemetry.counter('bot_handler_errors_total', **labels)))
+                    for labels, histogram in handlers]
+
+    transfers = {tuple(sorted(labels.items())): histogram
+                 for labels, histogram in telemetry.series('ssh_transfer_seconds')}
+    commands = sorted(telemetry.series('ssh_exec_seconds'), key=lambda item: -item[1].count)[:15]
+    ssh_rows = [(labels['server'], labels['kind'], histogram.count, format_seconds(histogram.quantile(0.95)),
+                 format_seconds(transfers[tuple(sorted(labels.items()))].quantile(0.95)),
+                 format_bytes(telemetry.counter('ssh_received_bytes_total', **labels)),
+                 int(telemetry.counter('ssh_errors_total', **labels)))
+                for labels, histogram in commands]
+
+    connect_rows = [(labels['server'], histogram.count, format_seconds(histogram.sum / histogram.count),
+                     int(telemetry.counter('ssh_connect_errors_total', **labels)))
+                    for labels, histogram in sorted(telemetry.series('ssh_connect_seconds'), key=lambda item: item[0]['server'])]
+
+    telegram_rows = [(labels['method'], histogram.count, format_seconds(histogram.quantile(0.95)),
+                      int(telemetry.counter('telegram_retry_after_total', **labels)),
+                      int(telemetry.counter('telegram_errors_total', **labels)))
+                     for labels, histogram in sorted(telemetry.series('telegram_request_seconds'), key=lambda item: -item[1].count)]
+
+    queues = [f"SSH {server}: {count}" for server, count in ssh_executor.pending.items() if count]
+    queues.append(f"Отправка в Telegram: {len(outbox.pending)}")
+
+    sections = ["📈 *Статистика*"]
+    if handler_rows:
+        sections.append("Обработчики:\n```\n" + format_table(('действие', 'n', 'p50', 'p95', 'ошибки'), handler_rows) + "\n```")
+    if ssh_rows:
+        sections.append("SSH команды:\n```\n" + format_table(('сервер', 'вид', 'n', 'exec p95', 'чтение p95', 'получено', 'ошибки'), ssh_rows) + "\n```")
+    if connect_rows:
+        sections.append("SSH подключения:\n```\n" + format_table(('сервер', 'n', 'среднее', 'ошибки'), connect_rows) + "\n```")
+    if telegram_rows:
+        sections.append("Telegram API:\n```\n" + format_table(('метод', 'n', 'p95', '429', 'ошибки'), telegram_rows) + "\n```")
+    sections.append("Очереди:\n" + '\n'.join(queues))
+    return '\n\n'.join(sections)
+
+async def handle_stats(message: Message) -> None:
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer('⛔ У вас нет доступа к этому боту.')
+        return
+
+    await message.answer(format_stats(), parse_mode='Markdown')
+
+async def handle_pool_stats(message: Message) -> None:
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer('⛔ У вас нет доступа к этому боту.')
+        return
+
+    stats = ssh_pool.get_stats()
+    await message.answer(
+        "🔌 *SSH пул соединений*\n\n"
+        f"Попадания: {stats['hits']}\n"
+        f"Промахи: {stats['misses']}\n"
+        f"Переподключения: {stats['reconnects']}\n"
+        f"Вытеснено по простою: {stats['evictions']}\n"
+        f"Открыто соединений: {stats['open']}\n"
+        f"Активных каналов: {stats['active']}\n\n"
+        "🗃 *Кэш команд*\n\n"
+        f"Попадания: {command_cache.stats['hits']}\n"
+        f"Промахи: {command_cache.stats['misses']}\n"
+        f"Совместные запросы: {command_cache.stats['shared']}\n"
+        f"Сброшено записей: {command_cache.stats['invalidated']}\n\n"
+        "📤 *Очередь отправки*\n\n"
+        f"Отправлено: {outbox.stats['sent']}\n"
+        f"Объединено правок: {outbox.stats['coalesced']}\n"
+        f"Повторов после 429: {outbox.stats['retried']}\n"
+        f"Ошибок: {outbox.stats['failed']}\n"
+        f"В очереди: {len(outbox.pending)}",
+        parse_mode='Markdown'
+    )
+
+class WebhookServer:
+    SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, settings: dict):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.url = settings['url'].rstrip('/')
+        self.path = settings.get('path', '/webhook')
+        self.host = settings.get('host', '0.0.0.0')
+        self.port = settings.get('port', 8080)
+        # Без заданного секрета генерируем свой: вебхук все равно регистрирует сам бот
+        self.secret_token = settings.get('secret_token') or secrets.token_urlsafe(32)
+        self.workers = settings.get('workers', 8)
+        self.queue_size = settings.get('queue_size', 1000)
+        self.drain_timeout = settings.get('drain_timeout', 30)
+        self.queue = None
+        self.stats = {'received': 0, 'rejected': 0, 'dropped': 0, 'failed': 0}
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/health', self.handle_health)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(self.SECRET_HEADER, ''), self.secret_token):
+            self.stats['rejected'] += 1
+            return web.Response(status=401)
+        try:
+            update = types.Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception as e:
+            logger.warning(f"Некорректное обновление от Telegram: {e}")
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже
+            self.stats['dropped'] += 1
+            return web.Response(status=503)
+        self.stats['received'] += 1
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        # Сервер вебхука открыт наружу, поэтому состояние очередей и пула доступно только через /metrics
+        return web.json_response({'status': 'ok'})
+
+    async def worker(self) -> None:
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.exception(f"Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def run(self) -> None:
+        self.queue = asyncio.Queue(self.queue_size)
+        telemetry.gauge('webhook_queue_depth', lambda: [({}, self.queue.qsize())])
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        runner = web.AppRunner(self.create_app())
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+            await self.bot.set_webhook(self.url + self.path, secret_token=self.secret_token,
+                                       allowed_updates=self.dispatcher.resolve_used_update_types())
+            logger.info(f"Вебхук слушает {self.host}:{self.port}{self.path}")
+            stopped = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(signum, stopped.set)
+                except (NotImplementedError, RuntimeError):
+                    pass
+            await stopped.wait()
+        finally:
+            # Перестаем принимать обновления и даем воркерам дообработать очередь
+            await runner.cleanup()
+            try:
+                await asyncio.wait_for(self.queue.join(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Не дождались обработки {self.queue.qsize()} обновлений")
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=telemetry.render(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+async def start_stats_server():
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, STATS_CONFIG.get('host', '127.0.0.1'), STATS_CONFIG['port']).start()
+    return runner
+
+def setup_dispatcher() -> None:
     dp.message.register(start, Command(commands=["start"]))
+    dp.message.register(handle_pool_stats, Command(commands=["pool"]))
+    dp.message.register(handle_docker_logs, Command(commands=["dockerlogs"]))
+    dp.message.register(handle_log_filter, Command(commands=["logfilter"]))
+    dp.message.register(handle_alerts, Command(commands=["alerts"]))
+    dp.message.register(handle_stats, Command(commands=["stats"]))
+    dp.message.register(handle_rolling, Command(commands=["rolling"]))
+    dp.message.register(handle_probe, Command(commands=["probe"]))
+    dp.message.register(handle_probe_group, Command(commands=["probegroup"]))
     dp.message.register(handle_ping, StateFilter(PingState.waiting_for_address))
     dp.message.register(handle_menu)
     dp.callback_query.register(handle_callback)
+    dp.message.middleware(instrument_message)
+    dp.callback_query.middleware(instrument_callback)
+
+def log_background_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Фоновая задача {task.get_coro().__name__} остановилась", exc_info=task.exception())
+
+async def main() -> None:
+    setup_dispatcher()
+
+    background = [asyncio.create_task(pool_maintenance())]
+    if DOCKER_INVENTORY_CONFIG.get('enabled', True):
+        for inventory in container_inventories.values():
+            inventory.start()
+    if METRICS_CONFIG.get('enabled', True):
+        background.append(asyncio.create_task(metrics_sampler()))
+    for task in background:
+        task.add_done_callback(log_background_failure)
+
+    webhook = WEBHOOK_CONFIG.get('enabled') and WEBHOOK_CONFIG.get('url')
+    stats_runner = None
+    if STATS_CONFIG.get('port') and webhook and STATS_CONFIG['port'] == WEBHOOK_CONFIG.get('port', 8080):
+        logger.error("STATS.port совпадает с портом вебхука: метрики не отдаются наружу, укажите другой порт")
+    elif STATS_CONFIG.get('port'):
+        stats_runner = await start_stats_server()
 
     print("🤖 Бот запущен...")
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    try:
+        if webhook:
+            await WebhookServer(dp, bot, WEBHOOK_CONFIG).run()
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        if stats_runner is not None:
+            await stats_runner.cleanup()
+        for task in background:
+            task.cancel()
+        for inventory in container_inventories.values():
+            inventory.stop()
+        outbox.close()
+        ssh_executor.shutdown()
+        ssh_pool.close_all()
 
 if __name__ == '__main__':
     try: